@@ -1,6 +1,7 @@
 import os
 import sys
-from flask import Flask, send_from_directory, session
+import threading
+from flask import Flask, abort, session
 from dotenv import load_dotenv
 
 # --- FIX for ModuleNotFoundError when running via python app.py ---
@@ -32,8 +33,28 @@ def create_app():
     app.config['SESSION_TYPE'] = 'filesystem' # Stores sessions on the filesystem
     app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
     
-    # Ensure upload folder exists
+    # Pipeline checkpoints live outside the publicly served uploads folder
+    app.config['JOBS_FOLDER'] = os.path.join(app.root_path, 'jobs')
+
+    # Node-local scratch space for merge previews that are still being written
+    app.config['PREVIEW_FOLDER'] = os.path.join(app.root_path, 'previews')
+
+    # Ensure upload, jobs and preview folders exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['JOBS_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['PREVIEW_FOLDER'], exist_ok=True)
+
+    # Artifact and job-record storage (local folders by default, or an S3-compatible bucket for multi-node setups)
+    from services.storage import create_storage
+    app.extensions['artifact_storage'] = create_storage(app.config, app.config['UPLOAD_FOLDER'], 'uploads')
+    app.extensions['job_storage'] = create_storage(app.config, app.config['JOBS_FOLDER'], 'jobs')
+
+    # Shortest-job-first schedulers for the analysis, TTS and merge stages (historical timings persist with the jobs)
+    from services.scheduler import create_schedulers
+    app.extensions['schedulers'] = create_schedulers(app.config, os.path.join(app.config['JOBS_FOLDER'], 'stage_timings.json'))
+
+    # Merge preview responses that follow the file until the merge ends (clients that do not send Range requests)
+    app.extensions['preview_followers'] = threading.BoundedSemaphore(app.config['MERGE_PREVIEW_MAX_FOLLOWERS'])
 
     # Register blueprints
     from routes.main_routes import main_bp
@@ -41,10 +62,18 @@ def create_app():
     app.register_blueprint(main_bp)
     app.register_blueprint(settings_bp)
 
+    # Optionally pay the heavy SDK import cost now rather than on the first request
+    if app.config.get('PRELOAD_HEAVY_MODULES'):
+        from services.preload import warm_up
+        warm_up()
+
     @app.route('/static/uploads/<path:filename>')
     def serve_uploaded_file(filename):
-        """Serve files from the uploads directory."""
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        """Serve stored artifacts (directly from disk, or via a presigned redirect for S3)."""
+        try:
+            return app.extensions['artifact_storage'].serve(filename)
+        except ValueError:
+            abort(404)
 
     return app
 
@@ -0,0 +1,399 @@
+"""
+Memory and large-file benchmark for the pipeline stages.
+
+Generates synthetic inputs (multi-GB videos, long scripts) and drives the upload, analysis, speech
+and merge routes with each of them, one fresh interpreter per stage and size. Offline fakes stand in
+for Gemini, ElevenLabs, FFmpeg and ffprobe, so no API keys, network access or real media are needed.
+The fake FFmpeg also floods stdout and stderr the way a long merge can, so a pipe the app never reads
+shows up as a hang instead of passing silently.
+
+Reports wall time and peak RSS per stage and size, and exits with status 1 if a stage
+  - adds more than MEMORY_GROWTH_BUDGET_MB (config.py) to the interpreter's peak RSS,
+  - does not finish within --timeout seconds (e.g. a subprocess pipe deadlock), or
+  - scales worse than linearly: its time at the largest size exceeds the smallest size's time per
+    unit of input times the largest size by more than --scaling-tolerance (plus --scaling-slack
+    seconds for timer and disk-cache noise on fast stages).
+
+Usage:
+    python benchmarks/memory_benchmark.py [--sizes-mb 512,1024,2048] [--stages upload,analyze,speak,merge]
+                                          [--budget-mb MB] [--timeout SECONDS] [--work-dir DIR]
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import config
+
+STAGES = ('upload', 'analyze', 'speak', 'merge')
+CHUNK_SIZE = 1024 * 1024 # 1 MiB
+FAKE_BYTES_PER_SECOND = 250000 # ~2 Mbit/s video, used by the fake ffprobe/FFmpeg for durations
+AUDIO_BYTES_PER_VIDEO_BYTE = 1 / 20 # Size of the synthetic narration relative to its video
+SCRIPT_CHARS_PER_MB = 200 # Script length per MB of video for the speech stage
+FAKE_AUDIO_BYTES_PER_CHAR = 1000 # ~16 KB/s MP3 at ~15 spoken characters per second
+
+# Offline stand-ins, written into the work directory and put first on PATH/PYTHONPATH of every stage run
+FAKE_FFPROBE = """
+import os, sys
+print(os.path.getsize(sys.argv[-1]) / {bytes_per_second})
+"""
+
+FAKE_FFMPEG = """
+import sys
+args = sys.argv[1:]
+inputs = [args[i + 1] for i, arg in enumerate(args) if arg == '-i']
+outputs = [args[i + 1] for i, arg in enumerate(args) if arg == '-y']
+if args[-1] not in outputs:
+    outputs.append(args[-1]) # e.g. the preview, which follows '-f mp4'
+output_files = [open(path, 'wb') for path in outputs]
+copied = 0
+with open(inputs[0], 'rb') as video:
+    while True:
+        chunk = video.read({chunk_size})
+        if not chunk:
+            break
+        for output_file in output_files:
+            output_file.write(chunk)
+        copied += len(chunk)
+        seconds = copied / {bytes_per_second}
+        sys.stderr.write(f"frame={{copied // 40000}} fps=30 size={{copied // 1024}}kB "
+                         f"time={{int(seconds // 3600):02d}}:{{int(seconds % 3600 // 60):02d}}:{{seconds % 60:05.2f}} bitrate=2000.0kbits/s speed=10x\\r")
+        sys.stderr.flush()
+        sys.stdout.write('.' * 4096 + '\\n')
+        sys.stdout.flush()
+for output_file in output_files:
+    output_file.close()
+"""
+
+FAKE_GENAI = """
+from types import SimpleNamespace
+
+def configure(api_key=None):
+    pass
+
+def upload_file(path, display_name=None, mime_type=None):
+    # Reads the video the way a streaming upload does
+    with open(path, 'rb') as video:
+        while video.read({chunk_size}):
+            pass
+    return SimpleNamespace(name='files/offline-fake', uri='offline://files/offline-fake', display_name=display_name)
+
+def get_file(name):
+    return SimpleNamespace(name=name, display_name=name, state=SimpleNamespace(name='ACTIVE'))
+
+def delete_file(name):
+    pass
+
+class GenerativeModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, parts):
+        return SimpleNamespace(text='A synthetic narration of a synthetic video.')
+"""
+
+FAKE_ELEVENLABS = """
+class Voice:
+    def __init__(self, voice_id=None, settings=None):
+        self.voice_id = voice_id
+        self.settings = settings
+
+class VoiceSettings:
+    def __init__(self, **settings):
+        self.settings = settings
+"""
+
+FAKE_ELEVENLABS_CLIENT = """
+class ElevenLabs:
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    def generate(self, text, voice=None, model=None):
+        # Streams audio proportional to the script length in small chunks, like the real API
+        remaining = len(text) * {audio_bytes_per_char}
+        chunk = b'\\xff' * 16384
+        while remaining > 0:
+            yield chunk[:remaining]
+            remaining -= len(chunk)
+"""
+
+def write_fakes(work_dir):
+    """Writes the fake executables and SDK modules; returns (bin_dir, python_dir)."""
+    bin_dir = os.path.join(work_dir, 'fake_bin')
+    python_dir = os.path.join(work_dir, 'fake_python')
+    files = {
+        os.path.join(bin_dir, 'ffprobe'): FAKE_FFPROBE.format(bytes_per_second=FAKE_BYTES_PER_SECOND),
+        os.path.join(bin_dir, 'ffmpeg'): FAKE_FFMPEG.format(chunk_size=CHUNK_SIZE, bytes_per_second=FAKE_BYTES_PER_SECOND),
+        os.path.join(python_dir, 'google', '__init__.py'): '',
+        os.path.join(python_dir, 'google', 'generativeai', '__init__.py'): FAKE_GENAI.format(chunk_size=CHUNK_SIZE),
+        os.path.join(python_dir, 'elevenlabs', '__init__.py'): FAKE_ELEVENLABS,
+        os.path.join(python_dir, 'elevenlabs', 'client.py'): FAKE_ELEVENLABS_CLIENT.format(audio_bytes_per_char=FAKE_AUDIO_BYTES_PER_CHAR),
+    }
+    for path, source in files.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            if os.path.dirname(path) == bin_dir:
+                f.write(f"#!{sys.executable}\n")
+            f.write(source)
+        if os.path.dirname(path) == bin_dir:
+            os.chmod(path, 0o755)
+    return bin_dir, python_dir
+
+def write_synthetic_file(path, size):
+    """Writes size bytes of incompressible data, distinct per chunk, without holding more than a chunk in memory."""
+    block = os.urandom(CHUNK_SIZE)
+    with open(path, 'wb') as f:
+        written = 0
+        index = 0
+        while written < size:
+            chunk = (index.to_bytes(8, 'little') + block[8:])[:size - written]
+            f.write(chunk)
+            written += len(chunk)
+            index += 1
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, KiB on Linux
+
+def read_events(response):
+    """Parses a Server-Sent Events response body into its JSON messages (skipping non-JSON ones)."""
+    events = []
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('data: '):
+            try:
+                events.append(json.loads(line[len('data: '):]))
+            except json.JSONDecodeError:
+                pass
+    return events
+
+def link_input(app, source_path, key):
+    target_path = os.path.join(app.config['UPLOAD_FOLDER'], key)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+    return key
+
+def run_upload(app, spec):
+    import http.client
+    import threading
+    from werkzeug.serving import make_server
+
+    # A real HTTP server, so Werkzeug parses the multipart body exactly as in production
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        boundary = 'memory-benchmark-boundary'
+        head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"video\"; filename=\"synthetic.mp4\"\r\n"
+                f"Content-Type: video/mp4\r\n\r\n").encode('utf-8')
+        tail = f"\r\n--{boundary}--\r\n".encode('utf-8')
+
+        def body():
+            yield head
+            with open(spec['video_path'], 'rb') as video:
+                while True:
+                    chunk = video.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            yield tail
+
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=spec['timeout'])
+        connection.request('POST', '/upload_video', body=body(), headers={
+            'Content-Type': f'multipart/form-data; boundary={boundary}',
+            'Content-Length': str(len(head) + os.path.getsize(spec['video_path']) + len(tail)),
+        })
+        response = connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200 or result.get('status') != 'success':
+            raise RuntimeError(f"Upload failed: {response.status} {result}")
+    finally:
+        server.shutdown()
+
+def run_analyze(app, spec):
+    client = app.test_client()
+    video_key = link_input(app, spec['video_path'], 'synthetic_video.mp4')
+    with client.session_transaction() as session:
+        session['video_key'] = video_key
+    events = read_events(client.get(f'/stream_analysis_progress?video_filename={video_key}'))
+    if not events or events[-1].get('status') != 'complete':
+        raise RuntimeError(f"Analysis failed: {events[-1] if events else 'no events'}")
+
+def run_speak(app, spec):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['video_key'] = link_input(app, spec['video_path'], 'synthetic_video.mp4')
+    script_text = ('The narrator describes the scene. ' * (spec['script_chars'] // 34 + 1))[:spec['script_chars']]
+    response = client.post('/generate_speech', json={'script_text': script_text})
+    if response.status_code != 200 or response.json.get('status') != 'complete':
+        raise RuntimeError(f"Speech generation failed: {response.status_code} {response.get_data(as_text=True)[:500]}")
+
+def run_merge(app, spec):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['video_key'] = link_input(app, spec['video_path'], 'synthetic_video.mp4')
+        session['audio_key'] = link_input(app, spec['audio_path'], 'synthetic_audio.mp3')
+    events = read_events(client.get('/merge_video_audio'))
+    if not events or events[-1].get('status') != 'complete':
+        raise RuntimeError(f"Merge failed: {events[-1] if events else 'no events'}")
+
+STAGE_RUNNERS = {
+    'upload': run_upload,
+    'analyze': run_analyze,
+    'speak': run_speak,
+    'merge': run_merge,
+}
+
+def run_stage(spec):
+    """Runs one stage in this (fresh) interpreter and prints its report as the last line of stdout."""
+    import http.client # Imported before the baseline so only the stage itself is measured
+    from werkzeug.serving import make_server
+    from app import create_app
+    from services.storage import LocalStorage
+    from services.scheduler import create_schedulers
+
+    stage_dir = spec['stage_dir']
+    app = create_app()
+    app.config.update(
+        UPLOAD_FOLDER=os.path.join(stage_dir, 'uploads'),
+        JOBS_FOLDER=os.path.join(stage_dir, 'jobs'),
+        PREVIEW_FOLDER=os.path.join(stage_dir, 'previews'),
+        GEMINI_API_KEY='offline-fake',
+        ELEVENLABS_API_KEY='offline-fake',
+    )
+    os.makedirs(app.config['PREVIEW_FOLDER'], exist_ok=True)
+    app.extensions['artifact_storage'] = LocalStorage(app.config['UPLOAD_FOLDER'])
+    app.extensions['job_storage'] = LocalStorage(app.config['JOBS_FOLDER'])
+    app.extensions['schedulers'] = create_schedulers(app.config, os.path.join(app.config['JOBS_FOLDER'], 'stage_timings.json'))
+
+    baseline_mb = peak_rss_mb()
+    start_time = time.perf_counter()
+    STAGE_RUNNERS[spec['stage']](app, spec)
+    elapsed = time.perf_counter() - start_time
+    print(json.dumps({'seconds': elapsed, 'baseline_mb': baseline_mb, 'peak_mb': peak_rss_mb()}))
+
+def measure_stage(spec, bin_dir, python_dir):
+    """Runs one stage in a subprocess; returns its report, or a report with an 'error'."""
+    env = dict(os.environ, PRELOAD_HEAVY_MODULES='False', MERGE_PREVIEW_ENABLED='True')
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [python_dir, project_root, env.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--run-stage', json.dumps(spec)],
+        cwd=project_root, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        start_new_session=True, # So a timeout also stops the stage's FFmpeg
+    )
+    try:
+        stdout, stderr = process.communicate(timeout=spec['timeout'])
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        return {'error': f"did not finish within {spec['timeout']}s (deadlock or runaway slowdown)"}
+    if process.returncode != 0:
+        return {'error': f"exited with status {process.returncode}: {stderr.strip().splitlines()[-1] if stderr.strip() else ''}"}
+    # Routes print progress; the report is always the last line
+    return json.loads(stdout.strip().splitlines()[-1])
+
+def format_units(stage, units):
+    if stage == 'speak':
+        return f"{units / 1000:.0f}k chars"
+    return f"{units / CHUNK_SIZE:.0f} MB"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes-mb', default='512,1024,2048', help='Comma-separated synthetic video sizes in MB.')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma-separated stages to run.')
+    parser.add_argument('--budget-mb', type=float, default=config.MEMORY_GROWTH_BUDGET_MB, help='Allowed peak RSS growth per stage in MB.')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds one stage run may take before it counts as hung.')
+    parser.add_argument('--scaling-tolerance', type=float, default=1.5, help='Allowed ratio of time per unit between the largest and smallest size.')
+    parser.add_argument('--scaling-slack', type=float, default=1.0, help='Seconds of noise allowed on top of the linear extrapolation.')
+    parser.add_argument('--work-dir', help='Directory for synthetic inputs and outputs (needs roughly 4x the largest size free). Defaults to a temporary directory.')
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        run_stage(json.loads(args.run_stage))
+        return 0
+
+    sizes_mb = sorted(int(size) for size in args.sizes_mb.split(','))
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown_stages = set(stages) - set(STAGES)
+    if unknown_stages:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown_stages))}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='narrator_memory_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+    bin_dir, python_dir = write_fakes(work_dir)
+    failures = []
+
+    try:
+        results = {stage: [] for stage in stages}
+        for size_mb in sizes_mb:
+            video_path = os.path.join(work_dir, f'video_{size_mb}mb.mp4')
+            audio_path = os.path.join(work_dir, f'audio_{size_mb}mb.mp3')
+            print(f"Generating {size_mb} MB synthetic video...")
+            write_synthetic_file(video_path, size_mb * CHUNK_SIZE)
+            write_synthetic_file(audio_path, int(size_mb * CHUNK_SIZE * AUDIO_BYTES_PER_VIDEO_BYTE))
+
+            for stage in stages:
+                stage_dir = os.path.join(work_dir, f'{stage}_{size_mb}mb')
+                spec = {
+                    'stage': stage, 'stage_dir': stage_dir, 'timeout': args.timeout,
+                    'video_path': video_path, 'audio_path': audio_path,
+                    'script_chars': size_mb * SCRIPT_CHARS_PER_MB,
+                }
+                units = spec['script_chars'] if stage == 'speak' else size_mb * CHUNK_SIZE
+                # Every stage starts with its inputs in the page cache, so sizes are compared fairly
+                for input_path in (video_path, audio_path):
+                    with open(input_path, 'rb') as input_file:
+                        while input_file.read(CHUNK_SIZE):
+                            pass
+                report = measure_stage(spec, bin_dir, python_dir)
+                shutil.rmtree(stage_dir, ignore_errors=True)
+                results[stage].append((units, report))
+
+                if 'error' in report:
+                    print(f"  {stage:<8} {format_units(stage, units):>12}  FAILED: {report['error']}")
+                    failures.append(f"{stage} at {format_units(stage, units)}: {report['error']}")
+                    continue
+                growth = report['peak_mb'] - report['baseline_mb']
+                print(f"  {stage:<8} {format_units(stage, units):>12}  {report['seconds']:8.2f}s  "
+                      f"peak RSS {report['peak_mb']:7.1f} MB (+{growth:.1f} MB)")
+                if growth > args.budget_mb:
+                    failures.append(f"{stage} at {format_units(stage, units)}: peak RSS grew {growth:.1f} MB (budget {args.budget_mb:.0f} MB)")
+
+            os.remove(video_path)
+            os.remove(audio_path)
+
+        # Time per unit must not grow with input size (allowing for noise and fixed overheads)
+        for stage, stage_results in results.items():
+            measured = [(units, report['seconds']) for units, report in stage_results if 'error' not in report]
+            if len(measured) < 2:
+                continue
+            (smallest_units, smallest_seconds), (largest_units, largest_seconds) = measured[0], measured[-1]
+            ratio = (largest_seconds / largest_units) / (smallest_seconds / smallest_units)
+            print(f"{stage}: time per unit at {format_units(stage, largest_units)} is {ratio:.2f}x that at {format_units(stage, smallest_units)}")
+            linear_seconds = smallest_seconds / smallest_units * largest_units
+            if largest_seconds > args.scaling_tolerance * linear_seconds + args.scaling_slack:
+                failures.append(f"{stage} scales worse than linearly: {ratio:.2f}x time per unit (tolerance {args.scaling_tolerance:.2f}x)")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
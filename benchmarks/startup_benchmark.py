@@ -0,0 +1,72 @@
+"""
+Startup-time benchmark for the web app.
+
+Times a cold create_app() in fresh interpreters (what every gunicorn worker restart pays)
+and exits with status 1 if the median exceeds STARTUP_TIME_BUDGET from config.py, or if any
+of the heavy SDKs listed in services/preload.py were imported eagerly.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5] [--budget SECONDS]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import config
+from services.preload import HEAVY_MODULES
+
+# Executed in a fresh interpreter so module caches from previous runs do not hide import cost
+CHILD_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start_time
+heavy_modules = json.loads(sys.argv[1])
+print(json.dumps({'seconds': elapsed, 'eager': [m for m in heavy_modules if m in sys.modules]}))
+"""
+
+def measure_cold_start():
+    """Runs one cold create_app() in a subprocess and returns its timing report."""
+    env = dict(os.environ, PRELOAD_HEAVY_MODULES='False')
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD_SCRIPT, json.dumps(HEAVY_MODULES)],
+        cwd=project_root, env=env, text=True
+    )
+    # create_app() may print warnings; the report is always the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Number of cold starts to measure.')
+    parser.add_argument('--budget', type=float, default=config.STARTUP_TIME_BUDGET, help='Budget in seconds for the median cold start.')
+    args = parser.parse_args()
+
+    reports = [measure_cold_start() for _ in range(args.runs)]
+    timings = [report['seconds'] for report in reports]
+    eager_imports = sorted({module for report in reports for module in report['eager']})
+    median = statistics.median(timings)
+
+    print(f"create_app() cold start over {args.runs} runs: median {median:.3f}s, min {min(timings):.3f}s, max {max(timings):.3f}s (budget {args.budget:.3f}s)")
+
+    failed = False
+    if median > args.budget:
+        print(f"FAIL: median cold start {median:.3f}s exceeds budget of {args.budget:.3f}s")
+        failed = True
+    if eager_imports:
+        print(f"FAIL: heavy modules imported during app creation: {', '.join(eager_imports)}")
+        failed = True
+
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
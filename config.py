@@ -13,3 +13,44 @@ YOUTUBE_CLIENT_ID = os.getenv('YOUTUBE_CLIENT_ID') # For OAuth
 YOUTUBE_CLIENT_SECRET = os.getenv('YOUTUBE_CLIENT_SECRET') # For OAuth
 
 # GOOGLE_APPLICATION_CREDENTIALS is removed as Google Cloud TTS is no longer used.
+
+# Startup performance
+# Heavy SDKs (Gemini, ElevenLabs) are imported lazily. Set PRELOAD_HEAVY_MODULES to import them
+# inside create_app() instead, e.g. when the gunicorn master should pay the cost once before forking.
+PRELOAD_HEAVY_MODULES = os.getenv('PRELOAD_HEAVY_MODULES', 'False').lower() in ('true', '1', 't')
+# Maximum seconds a cold create_app() may take; enforced by benchmarks/startup_benchmark.py
+STARTUP_TIME_BUDGET = float(os.getenv('STARTUP_TIME_BUDGET', '1.5'))
+# Maximum MB a pipeline stage may add to a worker's peak RSS, whatever the input size;
+# enforced by benchmarks/memory_benchmark.py
+MEMORY_GROWTH_BUDGET_MB = int(os.getenv('MEMORY_GROWTH_BUDGET_MB', '64'))
+
+# Narration variants: maximum number of ElevenLabs requests run in parallel by /generate_narration_variants
+TTS_MAX_PARALLEL = int(os.getenv('TTS_MAX_PARALLEL', '4'))
+# Narration variants: maximum number of variants accepted in one /generate_narration_variants request
+NARRATION_VARIANTS_MAX = int(os.getenv('NARRATION_VARIANTS_MAX', '8'))
+
+# Merge preview: on request (/merge_video_audio?preview=1) the merge also writes a fragmented MP4 that
+# /merge_preview serves while FFmpeg is still running; set to False to refuse such requests
+MERGE_PREVIEW_ENABLED = os.getenv('MERGE_PREVIEW_ENABLED', 'True').lower() in ('true', '1', 't')
+# Preview requests without a Range header stream until the merge ends and hold a server thread that long; cap them
+MERGE_PREVIEW_MAX_FOLLOWERS = int(os.getenv('MERGE_PREVIEW_MAX_FOLLOWERS', '4'))
+
+# Scheduler for analysis, TTS and merge: slots per stage, how many slots one user may hold per stage,
+# and how many seconds of estimated cost are forgiven per second a job has waited (prevents starvation)
+SCHEDULER_ANALYSIS_SLOTS = int(os.getenv('SCHEDULER_ANALYSIS_SLOTS', '2'))
+SCHEDULER_TTS_SLOTS = int(os.getenv('SCHEDULER_TTS_SLOTS', '4'))
+SCHEDULER_MERGE_SLOTS = int(os.getenv('SCHEDULER_MERGE_SLOTS', '2'))
+SCHEDULER_PER_USER_LIMIT = int(os.getenv('SCHEDULER_PER_USER_LIMIT', '1'))
+SCHEDULER_AGING_RATE = float(os.getenv('SCHEDULER_AGING_RATE', '1.0'))
+
+# Artifact storage: 'local' keeps uploads and job records in local folders (single node);
+# 's3' stores them in an S3-compatible bucket so any node can serve any stage of any job.
+# S3_ENDPOINT_URL points the backend at MinIO or a local stand-in instead of AWS.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+S3_BUCKET = os.getenv('S3_BUCKET')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+S3_REGION = os.getenv('S3_REGION')
+S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID')
+S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY')
+S3_MULTIPART_PART_SIZE = int(os.getenv('S3_MULTIPART_PART_SIZE', str(8 * 1024 * 1024)))
+S3_PRESIGNED_URL_EXPIRY = int(os.getenv('S3_PRESIGNED_URL_EXPIRY', '3600'))
@@ -0,0 +1,21 @@
+# Gunicorn configuration for production.
+# Run with: gunicorn -c gunicorn.conf.py "app:create_app()"
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5005')
+# A single worker process: the stage scheduler's queues and slot counts live in memory, so one process
+# is what makes shortest-job-first, aging and the per-user limit apply to every request, and the
+# SCHEDULER_* slot counts the real limits for the whole server. Concurrency comes from threads.
+workers = 1
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '600')) # Analysis and merges are long-running requests
+# Progress streams, jobs queued in the scheduler and merge previews each hold a thread for as long as they
+# are open, so keep this well above the total of the SCHEDULER_* slots
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+
+# Load the app once in the master process so workers are forked from a warm interpreter.
+preload_app = True
+
+def on_starting(server):
+    """Imports the heavy service SDKs in the master before any worker is forked."""
+    from services.preload import warm_up
+    warm_up()
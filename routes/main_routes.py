@@ -1,30 +1,184 @@
 import os
 import uuid
+from contextlib import ExitStack
 from flask import Blueprint, request, jsonify, render_template, current_app, session, Response
 from werkzeug.utils import secure_filename
 import time
 import json # For JSON encoding of SSE messages
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
 
 # Import services
 from services.video_analysis import analyze_video_with_openai
 from services.audio_synthesis import convert_text_to_speech_gemini
-from services.video_merging import merge_video_audio
+from services.video_merging import merge_video_audio, merge_video_audio_variants, probe_duration
+from services import media_store, pipeline_state, variant_batches
+from services.merge_preview import get_preview_path, start_preview, follow_preview, read_preview_range, remove_preview
+from services.audio_synthesis import DEFAULT_VOICE_ID
+from services.scheduler import estimate_units, describe_forecast
+from services.storage import validate_key
 from services.youtube_api import upload_video_to_youtube # Placeholder for now
 
 main_bp = Blueprint('main', __name__)
 
+def get_artifact_storage():
+    return current_app.extensions['artifact_storage']
+
+def get_job_storage():
+    return current_app.extensions['job_storage']
+
+def media_url(key):
+    """Browser URL of a stored artifact (served by app.serve_uploaded_file)."""
+    return f'/static/uploads/{key}'
+
+def get_known_duration(storage, content_hash, video_key):
+    """Returns the video's duration, reusing (and filling) the deduplicated content's cached value."""
+    if not content_hash:
+        return probe_duration(storage.input_location(video_key))
+    total_duration = media_store.load_metadata(get_job_storage(), content_hash).get('duration')
+    if total_duration is None:
+        total_duration = probe_duration(storage.input_location(video_key))
+        if total_duration is not None:
+            media_store.update_metadata(get_job_storage(), content_hash, duration=total_duration)
+    return total_duration
+
+def get_user_id():
+    """Returns a stable per-browser id (kept in the session) used for per-user scheduling fairness and job ownership."""
+    if 'user_id' not in session:
+        session['user_id'] = str(uuid.uuid4())
+        session.permanent = True # Outlives the browser session, like the job id the page saves for resuming
+    return session['user_id']
+
+def get_scheduler(stage):
+    return current_app.extensions['schedulers'][stage]
+
+def format_forecast_event(forecast, stage_label):
+    """SSE progress message carrying the scheduler's estimated start and finish times."""
+    return f"data: {json.dumps({'status': 'in_progress', 'progress': 0, 'message': describe_forecast(forecast, stage_label), **forecast})}\n\n"
+
+def synthesize_variant(app, script_text, audio_key, voice_id):
+    """Runs one TTS job to completion in its own app context (used from worker threads) and returns the audio's hash."""
+    with app.app_context():
+        with app.extensions['artifact_storage'].local_output(audio_key) as audio_path:
+            tts_generator = convert_text_to_speech_gemini(script_text, audio_path, voice_id=voice_id)
+            while True:
+                try:
+                    next(tts_generator)
+                except StopIteration:
+                    break
+            audio_hash = media_store.hash_file(audio_path)
+        return audio_hash
+
+def run_narration_variants(app, batch_id, batch):
+    """
+    Runs a narration variants batch started by /generate_narration_variants (in a background thread),
+    reporting progress in its batch record: TTS for every variant in parallel, then one merge pass.
+    """
+    with app.app_context():
+        storage = get_artifact_storage()
+        job_storage = get_job_storage()
+        job_id = batch['job_id']
+        video_key = batch['video_key']
+        audio_tracks = batch['audio_tracks']
+        audio_keys = [track['key'] for track in audio_tracks]
+        output_keys = batch['output_keys']
+        speech_scheduler = get_scheduler('speak')
+        merge_scheduler = get_scheduler('merge')
+        speech_ticket = None
+        merge_ticket = None
+
+        try:
+            print(f"Starting {len(audio_tracks)} narration variants (TTS in parallel, single merge pass)...")
+            # The batch is admitted once, like a single request, and runs its variants on as many speech slots as it is granted
+            speech_ticket = speech_scheduler.submit(batch['user_id'], estimate_units('speak', script_chars=sum(len(text) for text in batch['script_texts'])),
+                                                    max_slots=min(app.config.get('TTS_MAX_PARALLEL', 4), len(audio_tracks)))
+            for forecast in speech_scheduler.wait(speech_ticket):
+                variant_batches.update_batch(job_storage, batch_id, status='in_progress', message=describe_forecast(forecast, 'Speech'))
+
+            with ThreadPoolExecutor(max_workers=speech_ticket.slots) as executor:
+                futures = [
+                    executor.submit(synthesize_variant, app, script_text, track['key'], track['voice_id'])
+                    for script_text, track in zip(batch['script_texts'], audio_tracks)
+                ]
+                pending = futures
+                while pending:
+                    done, pending = wait_for_futures(pending, timeout=variant_batches.HEARTBEAT_SECONDS)
+                    finished = len(futures) - len(pending)
+                    variant_batches.update_batch(job_storage, batch_id, progress=int(finished * 50 / len(futures)),
+                                                 message=f'Speech: {finished} of {len(futures)} variants done')
+                audio_hashes = [future.result() for future in futures] # Re-raises the first TTS failure
+            speech_scheduler.release(speech_ticket)
+            speech_ticket = None
+            if job_id:
+                pipeline_state.record_checkpoint(job_storage, storage, job_id, 'speak', batch['speech_inputs'], output_key=audio_keys[0],
+                                                 output_hash=audio_hashes[0], result={'variant_keys': audio_keys})
+
+            total_duration = get_known_duration(storage, batch['content_hash'], video_key)
+            merge_ticket = merge_scheduler.submit(batch['user_id'], estimate_units('merge', duration=total_duration, file_size=storage.stat(video_key)['size']))
+            for forecast in merge_scheduler.wait(merge_ticket):
+                variant_batches.update_batch(job_storage, batch_id, progress=50, message=describe_forecast(forecast, 'Merge'))
+
+            # FFmpeg reads every input straight from storage and writes all outputs locally before they are stored
+            merge_tracks = [dict(track, path=storage.input_location(track['key'])) for track in audio_tracks]
+            with ExitStack() as outputs:
+                output_paths = [outputs.enter_context(storage.local_output(key)) for key in output_keys]
+                merge_generator_obj = merge_video_audio_variants(storage.input_location(video_key), merge_tracks, output_paths, total_duration=total_duration)
+                last_update = 0
+                while True:
+                    try:
+                        progress_info = json.loads(next(merge_generator_obj))
+                    except StopIteration:
+                        break
+                    if time.time() - last_update >= 1: # FFmpeg reports several times a second; the poller needs far less
+                        last_update = time.time()
+                        variant_batches.update_batch(job_storage, batch_id, progress=50 + progress_info.get('progress', 0) // 2,
+                                                     message=progress_info.get('message'))
+                merged_hash = media_store.hash_file(output_paths[0])
+            merge_scheduler.release(merge_ticket)
+            merge_ticket = None
+
+            if job_id:
+                merge_inputs = {
+                    'video_hash': pipeline_state.get_output_hash(job_storage, storage, job_id, video_key),
+                    'audio_hashes': audio_hashes,
+                    'output_mode': batch['output_mode'],
+                }
+                pipeline_state.record_checkpoint(job_storage, storage, job_id, 'merge', merge_inputs, output_key=output_keys[0],
+                                                 output_hash=merged_hash, result={'variant_keys': output_keys})
+
+            variant_batches.update_batch(job_storage, batch_id, status='complete', progress=100,
+                                         message=f'{len(audio_tracks)} narration variants created!',
+                                         result={'output_mode': batch['output_mode'], 'audio_tracks': audio_tracks,
+                                                 'audio_keys': audio_keys, 'output_keys': output_keys})
+
+        except Exception as e:
+            current_app.logger.error(f"Narration variants failed: {str(e)}", exc_info=True)
+            if speech_ticket:
+                speech_scheduler.release(speech_ticket, succeeded=False)
+            if merge_ticket:
+                merge_scheduler.release(merge_ticket, succeeded=False)
+            for key in audio_keys + output_keys:
+                storage.delete(key)
+            variant_batches.update_batch(job_storage, batch_id, status='error', message=f'Narration variants failed: {str(e)}')
+
 @main_bp.route('/')
 def index():
     """Renders the main application page."""
     # Clear session data on fresh load to prevent stale information
-    if 'video_path' in session:
-        session.pop('video_path', None)
+    if 'video_key' in session:
+        session.pop('video_key', None)
     if 'script' in session:
         session.pop('script', None)
-    if 'audio_path' in session:
-        session.pop('audio_path', None)
-    if 'merged_video_path' in session:
-        session.pop('merged_video_path', None)
+    if 'audio_key' in session:
+        session.pop('audio_key', None)
+    if 'merged_video_key' in session:
+        session.pop('merged_video_key', None)
+    if 'video_hash' in session:
+        session.pop('video_hash', None)
+    if 'variant_keys' in session:
+        session.pop('variant_keys', None)
+    if 'variant_batch_ids' in session:
+        session.pop('variant_batch_ids', None)
     return render_template('index.html')
 
 @main_bp.route('/upload_video', methods=['POST'])
@@ -41,29 +195,42 @@ def upload_video():
         return jsonify({'error': 'No selected video file'}), 400
 
     if file:
-        # Create a unique filename for the uploaded video
-        unique_filename = str(uuid.uuid4()) + "_" + secure_filename(file.filename)
-        video_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+        storage = get_artifact_storage()
+        job_storage = get_job_storage()
 
-        # Store original video path in session immediately for later use
-        session['video_path'] = video_path
+        # Every upload starts a new pipeline job; the job holds the reference to the stored content
+        job_id = pipeline_state.create_job(job_storage, get_user_id())
 
-        # Save the file to disk here
+        # Hash the file and store it once per unique content; the content's blob key is the upload's key
+        video_key = None
         try:
-            print(f"Saving uploaded file to: {video_path}")
-            file.save(video_path)
-            print("File saved successfully.")
+            content_hash, video_key, reused = media_store.save_upload_deduplicated(file, storage, job_storage, job_id)
+
+            # The upload is the job's first durable checkpoint
+            pipeline_state.record_checkpoint(job_storage, storage, job_id, 'upload', {'filename': secure_filename(file.filename)},
+                                             output_key=video_key, output_hash=content_hash)
+            print(f"File saved successfully as {video_key} ({'reused existing content' if reused else 'new content'}).")
         except Exception as e:
             current_app.logger.error(f"Error saving uploaded file: {str(e)}", exc_info=True)
+            if video_key:
+                media_store.release_upload(storage, job_storage, video_key, job_id)
+            pipeline_state.delete_job(job_storage, job_id)
             return jsonify({'error': f'Failed to save uploaded file: {str(e)}'}), 500
 
+        # Store the video key in session for later use
+        session['video_key'] = video_key
+        session['video_hash'] = content_hash
+        session['job_id'] = job_id
+
         # Now, return a JSON response indicating successful upload,
         # which will trigger the frontend to open a new SSE connection for analysis.
         return jsonify({
             'status': 'success',
-            'message': 'Video uploaded. Starting analysis...',
-            'unique_filename': unique_filename,
-            'video_url': f'/static/uploads/{unique_filename}'
+            'message': 'Identical video found. Reusing previous results...' if reused else 'Video uploaded. Starting analysis...',
+            'unique_filename': video_key,
+            'deduplicated': reused,
+            'job_id': job_id,
+            'video_url': media_url(video_key)
         })
 
     return jsonify({'error': 'An unexpected error occurred during upload.'}), 500
@@ -78,22 +245,59 @@ def stream_analysis_progress():
     if not unique_filename:
         return Response(f"data: {json.dumps({'status': 'error', 'message': 'Missing video_filename parameter.'})}\n\n", mimetype='text/event-stream')
 
-    video_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-    if not os.path.exists(video_path):
+    storage = get_artifact_storage()
+    try:
+        video_key = validate_key(unique_filename)
+    except ValueError:
+        video_key = None
+    if not video_key or not storage.exists(video_key):
         return Response(f"data: {json.dumps({'status': 'error', 'message': 'Video file not found for analysis.'})}\n\n", mimetype='text/event-stream')
 
     # Get the application instance to push context (if needed for things other than current_app.logger)
     app = current_app._get_current_object() # Get the real app object from the proxy
 
+    # Only trust the session's content hash if this file really is that blob
+    content_hash = session.get('video_hash')
+    if not media_store.is_upload_of(content_hash, video_key):
+        content_hash = None
+
+    job_storage = get_job_storage()
+    job_id = session.get('job_id')
+    upload_checkpoint = pipeline_state.get_valid_checkpoint(job_storage, storage, job_id, 'upload')
+    if not upload_checkpoint or upload_checkpoint['output_key'] != video_key:
+        job_id = None # The session's job is for a different upload
+    analysis_inputs = {'video_hash': upload_checkpoint['output_hash']} if job_id else None
+
+    user_id = get_user_id()
+    analysis_scheduler = get_scheduler('analyze')
+
     final_script_for_session = [] # To capture the script returned by the analysis generator
 
     # Define the generator function here, right before it's used
     def generate_analysis_stream():
         nonlocal final_script_for_session # To modify this variable
+        ticket = None
+        analysis_succeeded = False
 
         # Create a temporary request context for the duration of the generator
         with app.test_request_context():
             try:
+                # Resuming a job whose analysis already completed: skip straight to the result
+                analysis_checkpoint = pipeline_state.get_valid_checkpoint(job_storage, storage, job_id, 'analyze', analysis_inputs)
+                if analysis_checkpoint:
+                    session['script'] = analysis_checkpoint['result']
+                    yield f"data: {json.dumps({'status': 'complete', 'message': 'Analysis: Complete! (resumed from checkpoint)', 'script': analysis_checkpoint['result']})}\n\n"
+                    return
+
+                # Identical content was analyzed before: reuse the script instead of calling Gemini again
+                cached_script = media_store.load_metadata(job_storage, content_hash).get('script') if content_hash else None
+                if cached_script:
+                    if job_id:
+                        pipeline_state.record_checkpoint(job_storage, storage, job_id, 'analyze', analysis_inputs, result=cached_script)
+                    session['script'] = cached_script
+                    yield f"data: {json.dumps({'status': 'complete', 'message': 'Analysis: Complete! (reused previous analysis)', 'script': cached_script})}\n\n"
+                    return
+
                 temp_output_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'temp_analysis_' + str(uuid.uuid4()))
                 os.makedirs(temp_output_dir, exist_ok=True)
 
@@ -101,22 +305,30 @@ def stream_analysis_progress():
                 if not gemini_key:
                     raise ValueError("Gemini API Key is not configured. Please set it in settings.")
 
-                yield f"data: {json.dumps({'status': 'in_progress', 'progress': 0, 'message': 'Analysis: Initializing Gemini analysis...'})}\n\n"
+                # Wait for an analysis slot: shorter videos go first, and aging makes sure long ones still get their turn
+                video_duration = get_known_duration(storage, content_hash, video_key)
+                ticket = analysis_scheduler.submit(user_id, estimate_units('analyze', duration=video_duration, file_size=storage.stat(video_key)['size']))
+                for forecast in analysis_scheduler.wait(ticket):
+                    yield format_forecast_event(forecast, 'Analysis')
 
-                analysis_generator_obj = analyze_video_with_openai(video_path, temp_output_dir, gemini_key)
+                yield f"data: {json.dumps({'status': 'in_progress', 'progress': 0, 'message': 'Analysis: Initializing Gemini analysis...'})}\n\n"
 
-                script_data_returned = None # Initialize to None to differentiate from empty list
-                while True: # Loop through the generator to get progress and capture return value
-                    try:
-                        progress_update = next(analysis_generator_obj)
-                        # The analyze_video_with_openai service now RETURNS the script, it does not yield it.
-                        # So, this 'if isinstance(progress_update, dict) and 'final_script_data' in progress_update:'
-                        # block should theoretically not be hit for the final script.
-                        # It will only yield progress updates.
-                        yield f"data: {json.dumps(progress_update)}\n\n" # Yield regular progress updates
-                    except StopIteration as e:
-                        script_data_returned = e.value # Capture the return value of the generator
-                        break # Exit loop
+                # The Gemini File API needs a local file; with a remote backend this node fetches its own copy
+                with storage.local_copy(video_key) as video_path:
+                    analysis_generator_obj = analyze_video_with_openai(video_path, temp_output_dir, gemini_key)
+
+                    script_data_returned = None # Initialize to None to differentiate from empty list
+                    while True: # Loop through the generator to get progress and capture return value
+                        try:
+                            progress_update = next(analysis_generator_obj)
+                            # The analyze_video_with_openai service now RETURNS the script, it does not yield it.
+                            # So, this 'if isinstance(progress_update, dict) and 'final_script_data' in progress_update:'
+                            # block should theoretically not be hit for the final script.
+                            # It will only yield progress updates.
+                            yield f"data: {json.dumps(progress_update)}\n\n" # Yield regular progress updates
+                        except StopIteration as e:
+                            script_data_returned = e.value # Capture the return value of the generator
+                            break # Exit loop
 
                 # --- Debugging Log ---
                 current_app.logger.debug(f"Analysis Generator returned: {script_data_returned}, type: {type(script_data_returned)}")
@@ -127,6 +339,15 @@ def stream_analysis_progress():
                     current_app.logger.warning(f"analyze_video_with_openai did not return a list for script data. Received type: {type(script_data_returned)}, value: {script_data_returned}")
                     script_data_returned = [] # Default to empty list to prevent frontend .map() error
 
+                # Cache successful analyses next to the blob for repeat uploads of the same content,
+                # and checkpoint them so a resumed job never pays for the Gemini call twice
+                if script_data_returned and not any(item.get('time') == 'Error' for item in script_data_returned):
+                    analysis_succeeded = True
+                    if content_hash:
+                        media_store.update_metadata(job_storage, content_hash, script=script_data_returned)
+                    if job_id:
+                        pipeline_state.record_checkpoint(job_storage, storage, job_id, 'analyze', analysis_inputs, result=script_data_returned)
+
                 final_script_for_session = script_data_returned # Store in nonlocal variable
                 session['script'] = final_script_for_session # Store in session here
 
@@ -134,13 +355,13 @@ def stream_analysis_progress():
 
             except Exception as e:
                 error_message = f"Video analysis failed: {str(e)}"
-                if os.path.exists(video_path):
-                    os.remove(video_path)
+                # The upload is kept (and checkpointed) so the job can resume analysis without re-uploading
                 current_app.logger.error(error_message, exc_info=True)
                 yield f"data: {json.dumps({'status': 'error', 'message': error_message})}\n\n"
             finally:
                 # Cleanup of temp_output_dir is handled in video_analysis.py's finally block now.
-                pass # No need for cleanup here, it's in the service.
+                if ticket:
+                    analysis_scheduler.release(ticket, succeeded=analysis_succeeded)
 
     return Response(generate_analysis_stream(), mimetype='text/event-stream')
 
@@ -157,117 +378,390 @@ def generate_speech():
     if not script_text:
         return jsonify({'error': 'No script text provided'}), 400
 
-    video_path = session.get('video_path')
-    if not video_path or not os.path.exists(video_path):
+    storage = get_artifact_storage()
+    video_key = session.get('video_key')
+    if not video_key or not storage.exists(video_key):
         return jsonify({'error': 'Original video not found. Please upload again.'}), 400
 
     # Get the application instance to push context (required for session access and current_app.config)
     app = current_app._get_current_object()
 
-    # Generate a unique filename for the audio
-    audio_filename = str(uuid.uuid4()) + ".mp3"
-    audio_path = os.path.join(current_app.config['UPLOAD_FOLDER'], audio_filename)
+    # Same script and voice as a completed checkpoint: reuse that audio instead of calling ElevenLabs again
+    job_storage = get_job_storage()
+    job_id = session.get('job_id')
+    speech_inputs = {'script_hash': pipeline_state.hash_text(script_text), 'voice_id': DEFAULT_VOICE_ID}
+    speech_checkpoint = pipeline_state.get_valid_checkpoint(job_storage, storage, job_id, 'speak', speech_inputs)
+    if speech_checkpoint:
+        session['audio_key'] = speech_checkpoint['output_key']
+        return jsonify({
+            'status': 'complete',
+            'message': 'Speech generation complete! (resumed from checkpoint)',
+            'audio_url': media_url(speech_checkpoint['output_key'])
+        })
+
+    # Generate a unique key for the audio
+    audio_key = str(uuid.uuid4()) + ".mp3"
+
+    speech_scheduler = get_scheduler('speak')
+    ticket = speech_scheduler.submit(get_user_id(), estimate_units('speak', script_chars=len(script_text)))
+    speech_succeeded = False
 
     with app.app_context(): # Ensure application context for current_app.config and session access
         try:
+            speech_scheduler.acquire(ticket) # Shorter scripts are served first
             print("Starting speech generation (server-side, blocking process)...")
 
-            # Execute the convert_text_to_speech_gemini generator fully to get the final audio path
-            tts_generator = convert_text_to_speech_gemini(script_text, audio_path)
+            with storage.local_output(audio_key) as audio_path:
+                # Execute the convert_text_to_speech_gemini generator fully to get the final audio path
+                tts_generator = convert_text_to_speech_gemini(script_text, audio_path)
 
-            final_audio_path_data = None
-            # Iterate through the generator to execute it and capture its return value
-            while True:
-                try:
-                    # Next call will execute up to the next yield or the return
-                    progress_info = next(tts_generator)
-                    # For this blocking route, we don't stream intermediate progress to frontend,
-                    # but we can log them if needed.
-                    current_app.logger.debug(f"TTS Service Progress (Internal): {json.loads(progress_info.strip('data: ')).get('message')}")
-                except StopIteration as e:
-                    final_audio_path_data = e.value # Capture the return value (the final audio path)
-                    break # Exit loop
-
-            # After the generator completes and returns, store the audio path in session
-            session['audio_path'] = final_audio_path_data
+                # Iterate through the generator to execute it and capture its return value
+                while True:
+                    try:
+                        # Next call will execute up to the next yield or the return
+                        progress_info = next(tts_generator)
+                        # For this blocking route, we don't stream intermediate progress to frontend,
+                        # but we can log them if needed.
+                        current_app.logger.debug(f"TTS Service Progress (Internal): {json.loads(progress_info.strip('data: ')).get('message')}")
+                    except StopIteration:
+                        break # Exit loop
+
+                audio_hash = media_store.hash_file(audio_path)
+
+            # After the generator completes and the audio is stored, keep its key in session
+            session['audio_key'] = audio_key
+            if pipeline_state.load_job(job_storage, job_id):
+                pipeline_state.record_checkpoint(job_storage, storage, job_id, 'speak', speech_inputs, output_key=audio_key, output_hash=audio_hash)
+            speech_succeeded = True
 
             # Return the final JSON response
             return jsonify({
                 'status': 'complete',
                 'message': 'Speech generation complete!',
-                'audio_url': f'/static/uploads/{os.path.basename(final_audio_path_data)}'
+                'audio_url': media_url(audio_key)
             })
 
         except Exception as e:
             current_app.logger.error(f"Speech generation failed: {str(e)}", exc_info=True)
             return jsonify({'error': f'Speech generation failed: {str(e)}'}), 500
+        finally:
+            speech_scheduler.release(ticket, succeeded=speech_succeeded)
 
 
 @main_bp.route('/merge_video_audio', methods=['GET']) # Changed method to GET
 def merge_video_audio_route():
     """Merges the uploaded video and generated audio."""
-    video_path = session.get('video_path')
-    audio_path = session.get('audio_path')
+    storage = get_artifact_storage()
+    video_key = session.get('video_key')
+    audio_key = session.get('audio_key')
 
-    if not video_path or not os.path.exists(video_path):
+    if not video_key or not storage.exists(video_key):
         return jsonify({'error': 'Original video not found. Please upload again.'}), 400
-    if not audio_path or not os.path.exists(audio_path):
+    if not audio_key or not storage.exists(audio_key):
         return jsonify({'error': 'Generated audio not found. Please generate speech first.'}), 400
 
-    merged_filename = str(uuid.uuid4()) + "_merged.mp4"
-    merged_video_path = os.path.join(current_app.config['UPLOAD_FOLDER'], merged_filename)
+    merged_key = str(uuid.uuid4()) + "_merged.mp4"
+    preview_path = None
+    # The preview is a second full-size output, so it is only written when the page asks for one
+    if current_app.config.get('MERGE_PREVIEW_ENABLED') and request.args.get('preview') == '1':
+        preview_id = merged_key.replace('_merged.mp4', '_preview.mp4')
+        preview_path = get_preview_path(current_app.config['PREVIEW_FOLDER'], preview_id)
+        preview_url = f'/merge_preview/{preview_id}'
+
+    content_hash = session.get('video_hash')
+    if not media_store.is_upload_of(content_hash, video_key):
+        content_hash = None
+
+    job_storage = get_job_storage()
+    job_id = session.get('job_id')
+    if not pipeline_state.load_job(job_storage, job_id):
+        job_id = None
+    merge_inputs = None
+    if job_id:
+        merge_inputs = {
+            'video_hash': pipeline_state.get_output_hash(job_storage, storage, job_id, video_key),
+            'audio_hash': pipeline_state.get_output_hash(job_storage, storage, job_id, audio_key),
+        }
+
+    user_id = get_user_id()
+    merge_scheduler = get_scheduler('merge')
 
     app = current_app._get_current_object() # Get the real app object for context
 
     def progress_generator():
+        ticket = None
+        merge_succeeded = False
+
         # Push request context for session access within the generator
         with app.test_request_context():
             try:
                 yield "data: {'status': 'in_progress', 'message': 'Starting video-audio merge...'}\n\n"
 
-                # Execute the merge_video_audio service. It yields progress and returns the final path.
-                merge_generator_obj = merge_video_audio(video_path, audio_path, merged_video_path)
-
-                final_merged_video_path = None
-                while True: # Loop through the generator to get progress and capture return value
-                    try:
-                        progress_info = next(merge_generator_obj)
-                        yield f"data: {json.dumps(progress_info)}\n\n" # Yield progress updates
-                    except StopIteration as e:
-                        final_merged_video_path = e.value # Capture the return value (the final merged video path)
-                        break # Exit loop
-
-                session['merged_video_path'] = final_merged_video_path # Store merged video path in session
-                yield f"data: {json.dumps({'status': 'complete', 'message': 'Merge complete!', 'merged_video_url': f'/static/uploads/{os.path.basename(final_merged_video_path)}'})}\n\n"
+                merge_checkpoint = pipeline_state.get_valid_checkpoint(job_storage, storage, job_id, 'merge', merge_inputs)
+                if merge_checkpoint:
+                    session['merged_video_key'] = merge_checkpoint['output_key']
+                    yield f"data: {json.dumps({'status': 'complete', 'message': 'Merge complete! (resumed from checkpoint)', 'merged_video_url': media_url(merge_checkpoint['output_key'])})}\n\n"
+                    return
+
+                total_duration = get_known_duration(storage, content_hash, video_key)
+
+                # Wait for a merge slot, shortest expected merge first
+                ticket = merge_scheduler.submit(user_id, estimate_units('merge', duration=total_duration, file_size=storage.stat(video_key)['size']))
+                for forecast in merge_scheduler.wait(ticket):
+                    yield format_forecast_event(forecast, 'Merge')
+
+                # The page can start playing this while FFmpeg is still writing the final file
+                if preview_path:
+                    start_preview(preview_path)
+                    yield f"data: {json.dumps({'status': 'in_progress', 'progress': 0, 'message': 'Merge: Preview starting...', 'preview_url': preview_url})}\n\n"
+
+                # FFmpeg reads the inputs straight from storage; the output is written locally and then stored
+                with storage.local_output(merged_key) as merged_video_path:
+                    # Execute the merge_video_audio service. It yields progress and returns the final path.
+                    merge_generator_obj = merge_video_audio(storage.input_location(video_key), storage.input_location(audio_key),
+                                                            merged_video_path, total_duration=total_duration, preview_path=preview_path)
+
+                    while True: # Loop through the generator to get progress and capture return value
+                        try:
+                            progress_info = next(merge_generator_obj)
+                            yield f"data: {json.dumps(progress_info)}\n\n" # Yield progress updates
+                        except StopIteration:
+                            break # Exit loop
+
+                    merged_hash = media_store.hash_file(merged_video_path)
+
+                session['merged_video_key'] = merged_key # Store merged video key in session
+                if job_id:
+                    pipeline_state.record_checkpoint(job_storage, storage, job_id, 'merge', merge_inputs, output_key=merged_key, output_hash=merged_hash)
+                merge_succeeded = True
+                yield f"data: {json.dumps({'status': 'complete', 'message': 'Merge complete!', 'merged_video_url': media_url(merged_key)})}\n\n"
 
             except Exception as e:
                 current_app.logger.error(f"Video merging failed within generator: {str(e)}", exc_info=True)
                 yield f"data: {json.dumps({'status': 'error', 'message': f'Video merging failed: {str(e)}'})}\n\n"
+            finally:
+                if ticket:
+                    merge_scheduler.release(ticket, succeeded=merge_succeeded)
+                if preview_path:
+                    remove_preview(preview_path) # Also tells preview followers that the preview is complete
 
     return Response(progress_generator(), mimetype='text/event-stream')
 
 
+@main_bp.route('/merge_preview/<preview_id>')
+def merge_preview_route(preview_id):
+    """
+    Serves the fragmented-MP4 preview of a running merge to a <video> element while FFmpeg writes it.
+    Range requests get a 206 with the requested bytes written so far (the total length stays '*' until the
+    merge ends), so the player polls for more. Requests without a Range header stream the file until the
+    merge ends; those hold a thread each, so only MERGE_PREVIEW_MAX_FOLLOWERS run at once.
+    Previews live on the node running the merge, so behind a load balancer this request needs the same node.
+    """
+    try:
+        preview_path = get_preview_path(current_app.config['PREVIEW_FOLDER'], preview_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid preview id.'}), 404
+    headers = {'Cache-Control': 'no-store', 'Accept-Ranges': 'bytes'}
+
+    byte_range = request.range
+    if byte_range is None:
+        followers = current_app.extensions['preview_followers']
+        if not followers.acquire(blocking=False):
+            return jsonify({'error': 'Too many preview streams. Please retry with a Range request or later.'}), 503, {'Retry-After': '5'}
+        response = Response(follow_preview(preview_path), mimetype='video/mp4', headers=headers)
+        response.call_on_close(followers.release) # Runs even if the client disconnects before the stream starts
+        return response
+
+    # Only a single range from a known offset can be served from a file that is still growing
+    if byte_range.units != 'bytes' or len(byte_range.ranges) != 1 or byte_range.ranges[0][0] < 0:
+        headers['Content-Range'] = 'bytes */*'
+        return Response(status=416, headers=headers)
+    start, stop = byte_range.ranges[0]
+    preview = read_preview_range(preview_path, start, None if stop is None else stop - 1)
+    if preview is None:
+        return jsonify({'error': 'Preview not found. The merge may have finished.'}), 404
+    data, complete_size = preview
+    total = complete_size if complete_size is not None else '*'
+    if not data:
+        headers['Content-Range'] = f"bytes */{total}"
+        return Response(status=416, headers=headers)
+    headers['Content-Range'] = f"bytes {start}-{start + len(data) - 1}/{total}"
+    return Response(data, status=206, mimetype='video/mp4', headers=headers)
+
+@main_bp.route('/generate_narration_variants', methods=['POST'])
+def generate_narration_variants():
+    """
+    Starts producing several narration variants (language/voice combinations) in the background.
+    TTS runs in parallel for every variant, then a single FFmpeg pass reads the video once and writes
+    either one MP4 with an audio track per variant ('multi_track') or one MP4 per variant ('separate').
+    Responds 202 with the batch id; poll /narration_variants/<batch_id> for progress and the results.
+
+    Expects JSON like:
+        {"script_text": "...", "output_mode": "multi_track",
+         "variants": [{"language": "spa", "voice_id": "...", "script_text": "...", "title": "Spanish"}]}
+    A variant without its own script_text uses the top-level one.
+    """
+    data = request.json or {}
+    variants = data.get('variants') or []
+    output_mode = data.get('output_mode', 'multi_track')
+    default_script_text = data.get('script_text')
+
+    if not variants:
+        return jsonify({'error': 'No narration variants provided'}), 400
+    if not isinstance(variants, list) or not all(isinstance(variant, dict) for variant in variants):
+        return jsonify({'error': 'variants must be a list of objects'}), 400
+    max_variants = current_app.config.get('NARRATION_VARIANTS_MAX', 8)
+    if len(variants) > max_variants:
+        return jsonify({'error': f'At most {max_variants} narration variants can be created at once'}), 400
+    if output_mode not in ('multi_track', 'separate'):
+        return jsonify({'error': "output_mode must be 'multi_track' or 'separate'"}), 400
+    for variant in variants:
+        script_text = variant.get('script_text') or default_script_text
+        if not script_text or not isinstance(script_text, str):
+            return jsonify({'error': 'Every variant needs script text (or provide a top-level script_text)'}), 400
+        if any(variant.get(field) is not None and not isinstance(variant[field], str) for field in ('language', 'voice_id', 'title')):
+            return jsonify({'error': 'Variant language, voice_id and title must be strings'}), 400
+
+    storage = get_artifact_storage()
+    video_key = session.get('video_key')
+    if not video_key or not storage.exists(video_key):
+        return jsonify({'error': 'Original video not found. Please upload again.'}), 400
+
+    app = current_app._get_current_object()
+    content_hash = session.get('video_hash')
+    if not media_store.is_upload_of(content_hash, video_key):
+        content_hash = None
+
+    batch_id = str(uuid.uuid4())
+    audio_tracks = []
+    for index, variant in enumerate(variants):
+        suffix = secure_filename(variant.get('language') or '') or str(index)
+        audio_tracks.append({
+            'key': f"{batch_id}_{index}_{suffix}.mp3",
+            'language': variant.get('language'),
+            'title': variant.get('title'),
+            'voice_id': variant.get('voice_id'),
+        })
+
+    if output_mode == 'multi_track':
+        output_keys = [f"{batch_id}_narrated.mp4"]
+    else:
+        output_keys = [os.path.splitext(track['key'])[0] + "_merged.mp4" for track in audio_tracks]
+
+    # Both stages are checkpointed so /resume_job restores the variants and publishing reuses the output's hash
+    job_storage = get_job_storage()
+    job_id = session.get('job_id')
+    if not pipeline_state.load_job(job_storage, job_id):
+        job_id = None
+    speech_inputs = {
+        'variants': [
+            {
+                'script_hash': pipeline_state.hash_text(variant.get('script_text') or default_script_text),
+                'voice_id': track['voice_id'] or DEFAULT_VOICE_ID,
+                'language': track['language'],
+            }
+            for variant, track in zip(variants, audio_tracks)
+        ]
+    }
+
+    user_id = get_user_id()
+    variant_batches.create_batch(job_storage, batch_id, user_id, len(variants))
+    # Listed up front so /cleanup_files removes the outputs even if the client never polls the batch
+    session['variant_keys'] = (session.get('variant_keys') or []) + [track['key'] for track in audio_tracks] + output_keys
+    session['variant_batch_ids'] = (session.get('variant_batch_ids') or []) + [batch_id]
+
+    batch = {
+        'user_id': user_id,
+        'job_id': job_id,
+        'video_key': video_key,
+        'content_hash': content_hash,
+        'output_mode': output_mode,
+        'script_texts': [variant.get('script_text') or default_script_text for variant in variants],
+        'audio_tracks': audio_tracks,
+        'output_keys': output_keys,
+        'speech_inputs': speech_inputs,
+    }
+    threading.Thread(target=run_narration_variants, args=(app, batch_id, batch), daemon=True).start()
+
+    return jsonify({
+        'status': 'accepted',
+        'message': f'{len(variants)} narration variants started.',
+        'batch_id': batch_id,
+        'status_url': f'/narration_variants/{batch_id}',
+    }), 202
+
+@main_bp.route('/narration_variants/<batch_id>')
+def narration_variants_status(batch_id):
+    """Reports the progress of a narration variants batch; a completed batch becomes the session's audio and merged video."""
+    batch = variant_batches.load_batch(get_job_storage(), batch_id)
+    if not batch or batch['user_id'] != get_user_id():
+        return jsonify({'error': 'Narration variants batch not found.'}), 404
+
+    response = {key: batch[key] for key in ('batch_id', 'status', 'progress', 'message')}
+    if batch['status'] == 'complete':
+        result = batch['result']
+        session['audio_key'] = result['audio_keys'][0]
+        session['merged_video_key'] = result['output_keys'][0] # The first variant is what gets published by default
+        response['output_mode'] = result['output_mode']
+        response['variants'] = [
+            {
+                'language': track['language'],
+                'title': track['title'],
+                'voice_id': track['voice_id'],
+                'audio_url': media_url(track['key']),
+            }
+            for track in result['audio_tracks']
+        ]
+        response['merged_video_urls'] = [media_url(key) for key in result['output_keys']]
+    return jsonify(response)
+
+
 @main_bp.route('/upload_to_youtube', methods=['POST'])
 def upload_to_youtube_route():
     """Initiates the YouTube video upload."""
     # These are retrieved from the session outside the generator, which is fine
-    merged_video_path = session.get('merged_video_path')
+    storage = get_artifact_storage()
+    job_storage = get_job_storage()
+    merged_video_key = session.get('merged_video_key')
+    if not merged_video_key:
+        # The merge stream cannot write to the cookie session, so fall back to the job's merge checkpoint
+        merge_checkpoint = pipeline_state.get_valid_checkpoint(job_storage, storage, session.get('job_id'), 'merge')
+        merged_video_key = merge_checkpoint['output_key'] if merge_checkpoint else None
     video_title = request.json.get('video_title', 'My AI Generated Video')
     video_description = request.json.get('video_description', 'A video generated with AI narration.')
 
-    if not merged_video_path or not os.path.exists(merged_video_path):
+    if not merged_video_key or not storage.exists(merged_video_key):
         return jsonify({'error': 'Merged video not found. Please merge first.'}), 400
 
+    job_id = session.get('job_id')
+    if not pipeline_state.load_job(job_storage, job_id):
+        job_id = None
+    publish_inputs = None
+    if job_id:
+        publish_inputs = {
+            'merged_hash': pipeline_state.get_output_hash(job_storage, storage, job_id, merged_video_key),
+            'title': video_title,
+            'description': video_description,
+        }
+
     app = current_app._get_current_object() # Get the real app object for context
 
     try:
         def youtube_upload_progress():
             with app.test_request_context(): # Push request context for session access if needed in the future
                 try:
+                    # This exact video was already published by this job: do not upload it twice
+                    if pipeline_state.get_valid_checkpoint(job_storage, storage, job_id, 'publish', publish_inputs):
+                        yield f"data: {json.dumps({'status': 'complete', 'message': 'Already uploaded to YouTube (resumed from checkpoint).'})}\n\n"
+                        return
+
                     yield "data: {'status': 'in_progress', 'message': 'Starting YouTube upload...'}\n\n"
                     # This function will yield progress messages
-                    for progress_info in upload_video_to_youtube(merged_video_path, video_title, video_description):
-                        yield f"data: {progress_info}\n\n"
+                    with storage.local_copy(merged_video_key) as merged_video_path:
+                        for progress_info in upload_video_to_youtube(merged_video_path, video_title, video_description):
+                            yield f"data: {progress_info}\n\n"
+                    if job_id:
+                        pipeline_state.record_checkpoint(job_storage, storage, job_id, 'publish', publish_inputs, result={'title': video_title})
                     yield "data: {'status': 'complete', 'message': 'Upload to YouTube complete!'}\n\n"
                 except Exception as e:
                     current_app.logger.error(f"YouTube upload failed within generator: {str(e)}", exc_info=True)
@@ -280,23 +774,107 @@ def upload_to_youtube_route():
         current_app.logger.error(f"YouTube upload failed before generator: {str(e)}", exc_info=True)
         return jsonify({'error': f'YouTube upload failed: {str(e)}'}), 500
 
+@main_bp.route('/resume_job', methods=['POST'])
+def resume_job():
+    """
+    Restores a pipeline job after a restart or failure.
+    Every stage with a valid checkpoint is put back into the session so later routes skip it,
+    and the response tells the frontend which stage to continue from.
+    """
+    job_id = (request.get_json(silent=True) or {}).get('job_id') or session.get('job_id')
+    storage = get_artifact_storage()
+    resume_state = None
+    if job_id and pipeline_state.is_job_owner(get_job_storage(), job_id, get_user_id()):
+        resume_state = pipeline_state.get_resume_state(get_job_storage(), storage, job_id)
+    if resume_state is None:
+        return jsonify({'error': 'Job not found. Please upload again.'}), 404
+
+    checkpoints = resume_state['checkpoints']
+    if 'upload' not in checkpoints:
+        return jsonify({'error': 'The uploaded video for this job is no longer available. Please upload again.'}), 410
+
+    response = {
+        'status': 'success',
+        'job_id': job_id,
+        'completed_stages': list(checkpoints),
+        'next_stage': resume_state['next_stage'],
+    }
+
+    session['job_id'] = job_id
+    video_key = checkpoints['upload']['output_key']
+    session['video_key'] = video_key
+    session['video_hash'] = checkpoints['upload']['output_hash']
+    response['unique_filename'] = video_key
+    response['video_url'] = media_url(video_key)
+    if 'analyze' in checkpoints:
+        session['script'] = checkpoints['analyze']['result']
+        response['script'] = checkpoints['analyze']['result']
+    if 'speak' in checkpoints:
+        session['audio_key'] = checkpoints['speak']['output_key']
+        response['audio_url'] = media_url(checkpoints['speak']['output_key'])
+    if 'merge' in checkpoints:
+        session['merged_video_key'] = checkpoints['merge']['output_key']
+        response['merged_video_url'] = media_url(checkpoints['merge']['output_key'])
+    # Narration variant batches record all of their outputs, not just the first one
+    variant_keys = pipeline_state.get_variant_keys(checkpoints)
+    if variant_keys:
+        session['variant_keys'] = variant_keys
+        response['variant_urls'] = [media_url(key) for key in variant_keys]
+
+    return jsonify(response)
+
 @main_bp.route('/cleanup_files', methods=['POST'])
 def cleanup_files():
-    """Cleans up temporary files in the uploads folder related to the session."""
-    files_to_clean = [
-        session.pop('video_path', None),
-        session.pop('audio_path', None),
-        session.pop('merged_video_path', None)
-    ]
+    """Cleans up temporary files in storage related to the session."""
+    storage = get_artifact_storage()
+    job_storage = get_job_storage()
+    requested_job_id = (request.get_json(silent=True) or {}).get('job_id')
+    if requested_job_id and requested_job_id != session.get('job_id'):
+        if not pipeline_state.is_job_owner(job_storage, requested_job_id, get_user_id()):
+            return jsonify({'error': 'Job not found.'}), 404
+        # Discarding a saved job this session no longer tracks: its checkpoints list everything to remove
+        job_id, video_key, keys_to_clean = requested_job_id, None, []
+    else:
+        session.pop('video_hash', None)
+        job_id = session.pop('job_id', None)
+        video_key = session.pop('video_key', None)
+        keys_to_clean = [
+            session.pop('audio_key', None),
+            session.pop('merged_video_key', None)
+        ]
+        keys_to_clean += session.pop('variant_keys', None) or []
+        for batch_id in session.pop('variant_batch_ids', None) or []:
+            variant_batches.delete_batch(job_storage, batch_id)
+
+    # Streamed stages cannot write the cookie session, so the job's checkpoints are the complete list of its outputs
+    job = pipeline_state.load_job(job_storage, job_id)
+    if job:
+        for stage, checkpoint in job['checkpoints'].items():
+            if stage == 'upload':
+                video_key = checkpoint.get('output_key') or video_key
+            elif checkpoint.get('output_key') and checkpoint['output_key'] not in keys_to_clean:
+                keys_to_clean.append(checkpoint['output_key'])
+        keys_to_clean += [key for key in pipeline_state.get_variant_keys(job['checkpoints']) if key not in keys_to_clean]
+    pipeline_state.delete_job(job_storage, job_id)
     # Remove script from session too
     session.pop('script', None)
 
     removed_count = 0
-    for f_path in files_to_clean:
-        if f_path and os.path.exists(f_path):
+    for key in keys_to_clean:
+        if key:
             try:
-                os.remove(f_path)
+                if storage.exists(key):
+                    storage.delete(key)
+                    removed_count += 1
             except Exception as e:
-                current_app.logger.error(f"Error cleaning up file {f_path}: {e}", exc_info=True)
+                current_app.logger.error(f"Error cleaning up file {key}: {e}", exc_info=True)
+
+    # The upload is shared with other jobs of the same content: drop this job's reference, and the blob with the last one
+    if video_key and job_id:
+        try:
+            if media_store.release_upload(storage, job_storage, video_key, job_id):
+                removed_count += 1
+        except Exception as e:
+            current_app.logger.error(f"Error releasing stored upload {video_key}: {e}", exc_info=True)
 
     return jsonify({'message': f'Cleaned up {removed_count} temporary files.'})
@@ -1,17 +1,19 @@
 import os
 import json
 import time
-from elevenlabs import Voice, VoiceSettings, save # Keep Voice, VoiceSettings, save
-from elevenlabs.client import ElevenLabs # Import the client
 from flask import current_app # To access Flask's app config
 
-def convert_text_to_speech_gemini(text_script, output_audio_path):
+DEFAULT_VOICE_ID = "pNInz6obpgDQGcFmaJgB" # Voice ID for Adam (male voice)
+
+def convert_text_to_speech_gemini(text_script, output_audio_path, voice_id=None):
     """
     Converts a given text script into natural language speech using ElevenLabs Text-to-Speech.
 
     Args:
         text_script (str): The text content to convert to speech.
         output_audio_path (str): The full path where the generated audio file will be saved (e.g., .mp3).
+        voice_id (str, optional): ElevenLabs voice ID. Defaults to DEFAULT_VOICE_ID.
+            The multilingual model speaks whatever language the script is written in.
 
     Yields:
         str: JSON string indicating progress or completion for SSE.
@@ -23,10 +25,14 @@ def convert_text_to_speech_gemini(text_script, output_audio_path):
     if not elevenlabs_api_key:
         raise ValueError("ElevenLabs API Key is not configured. Please set it in settings.")
 
+    # The ElevenLabs SDK (httpx, pydantic models) is imported on first use to keep app startup fast.
+    from elevenlabs import Voice, VoiceSettings
+    from elevenlabs.client import ElevenLabs # Import the client
+
     # Initialize the ElevenLabs client by passing the API key directly
     client = ElevenLabs(api_key=elevenlabs_api_key)
 
-    voice_id_to_use = "pNInz6obpgDQGcFmaJgB" # Voice ID for Adam (male voice)
+    voice_id_to_use = voice_id or DEFAULT_VOICE_ID
 
     print("Starting ElevenLabs Text-to-Speech synthesis...")
     yield json.dumps({'status': 'in_progress', 'progress': 10, 'message': 'Speech: Sending text to ElevenLabs API...'})
@@ -41,17 +47,22 @@ def convert_text_to_speech_gemini(text_script, output_audio_path):
             model="eleven_multilingual_v2" # Recommended model for general use
         )
 
-        # Collect all chunks from the generator into a single bytes object
-        full_audio_bytes = b''
-        for chunk in audio_generator:
-            full_audio_bytes += chunk
-            # Optional: yield progress based on chunks received
-            # (Requires knowing total expected chunks which is not directly provided by ElevenLabs)
+        # Write the chunks to disk as they arrive, so long scripts never hold the whole audio in memory.
+        # The partial file only replaces output_audio_path once every chunk has been received.
+        partial_audio_path = output_audio_path + '.part'
+        try:
+            with open(partial_audio_path, 'wb') as audio_file:
+                for chunk in audio_generator:
+                    audio_file.write(chunk)
+                    # Optional: yield progress based on chunks received
+                    # (Requires knowing total expected chunks which is not directly provided by ElevenLabs)
 
-        yield json.dumps({'status': 'in_progress', 'progress': 70, 'message': 'Speech: Audio received. Saving file...'})
+            yield json.dumps({'status': 'in_progress', 'progress': 70, 'message': 'Speech: Audio received. Saving file...'})
 
-        # Save the complete bytes object to the specified file path
-        save(full_audio_bytes, output_audio_path)
+            os.replace(partial_audio_path, output_audio_path)
+        finally:
+            if os.path.exists(partial_audio_path):
+                os.remove(partial_audio_path)
         print(f"Audio content written to '{output_audio_path}'")
 
         yield json.dumps({'status': 'in_progress', 'progress': 100, 'message': 'Speech: File saved.'})
@@ -0,0 +1,170 @@
+import os
+import uuid
+import hashlib
+import threading
+
+# Uploads are stored once per unique content under the artifact storage key blobs/<sha256><ext>, and
+# that blob key is what the rest of the pipeline uses as the upload's key. Nothing is copied per upload:
+# each job that uses a blob records a small reference object instead (blob_refs/<blob name>@<job id>),
+# so repeat uploads cost no extra transfer and a blob is deleted once its last reference is released,
+# on every storage backend. Metadata and analysis results for each content hash are reused across
+# uploads. References and metadata (blob_metadata/<sha256>.json) are kept in the job storage, which
+# unlike the artifact storage is never served to browsers.
+BLOB_PREFIX = 'blobs'
+METADATA_PREFIX = 'blob_metadata'
+REFERENCE_PREFIX = 'blob_refs'
+CHUNK_SIZE = 1024 * 1024 # 1 MiB
+
+_metadata_lock = threading.Lock() # Serializes read-modify-write of metadata records within a process
+_reference_lock = threading.Lock() # Serializes adding and releasing references within a process
+
+def get_blob_key(content_hash, extension=''):
+    return f"{BLOB_PREFIX}/{content_hash}{extension}"
+
+def get_metadata_key(content_hash):
+    return f"{METADATA_PREFIX}/{content_hash}.json"
+
+def get_reference_prefix(blob_key):
+    return f"{REFERENCE_PREFIX}/{blob_key[len(BLOB_PREFIX) + 1:]}@"
+
+def get_upload_extension(filename):
+    """Lower-cased extension of an uploaded file name (kept on the blob so tools can detect its type)."""
+    extension = os.path.splitext(filename)[1].lower()
+    return extension if extension[1:].isalnum() else ''
+
+def hash_file(path):
+    """Returns the SHA-256 hex digest of a local file, read in chunks."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def hash_artifact(storage, key):
+    """Returns the SHA-256 hex digest of a stored artifact, streamed from storage."""
+    hasher = hashlib.sha256()
+    with storage.open_read(key) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _is_seekable(stream):
+    try:
+        stream.seek(0, os.SEEK_CUR)
+        return True
+    except (AttributeError, OSError, ValueError):
+        return False
+
+def _copy_stream(stream, target_file, hasher=None):
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if hasher:
+            hasher.update(chunk)
+        target_file.write(chunk)
+
+def save_upload_deduplicated(file_storage, storage, metadata_storage, reference_id):
+    """
+    Stores an uploaded file once per unique content and records a reference to it.
+
+    The upload is normally hashed while it is written to a temporary key, which is then renamed to its
+    blob key (or dropped if that content is already stored), so it is read only once. On backends where
+    move() copies the content (S3), a rewindable stream (Werkzeug spools uploads to a local temporary
+    file) is hashed first instead: identical content is then never transferred at all, and new content is
+    written straight to its blob key, which costs one extra local read but saves a remote copy.
+
+    Args:
+        file_storage (werkzeug.datastructures.FileStorage): The uploaded file.
+        storage (services.storage.StorageBackend): Artifact storage holding the blobs.
+        metadata_storage (services.storage.StorageBackend): Job storage holding references and metadata.
+        reference_id (str): Id of what uses the upload (the job id); release it with release_upload().
+
+    Returns:
+        tuple: (content_hash, blob_key, reused) where reused is True if identical content already existed.
+    """
+    stream = file_storage.stream
+    extension = get_upload_extension(file_storage.filename or '')
+    hasher = hashlib.sha256()
+
+    if not storage.move_is_rename and _is_seekable(stream):
+        start = stream.tell()
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+        stream.seek(start)
+        content_hash = hasher.hexdigest()
+        blob_key = get_blob_key(content_hash, extension)
+        reused = add_reference(storage, metadata_storage, blob_key, reference_id)
+        if not reused:
+            try:
+                with storage.open_write(blob_key) as blob_file: # Atomic, so concurrent identical uploads are safe
+                    _copy_stream(stream, blob_file)
+            except BaseException:
+                release_upload(storage, metadata_storage, blob_key, reference_id)
+                raise
+        return content_hash, blob_key, reused
+
+    incoming_key = f"{BLOB_PREFIX}/.incoming_{uuid.uuid4()}"
+    try:
+        with storage.open_write(incoming_key) as incoming_file:
+            _copy_stream(stream, incoming_file, hasher)
+        content_hash = hasher.hexdigest()
+        blob_key = get_blob_key(content_hash, extension)
+        reused = add_reference(storage, metadata_storage, blob_key, reference_id)
+        if not reused:
+            storage.move(incoming_key, blob_key)
+    finally:
+        if storage.exists(incoming_key):
+            storage.delete(incoming_key)
+    return content_hash, blob_key, reused
+
+def add_reference(storage, metadata_storage, blob_key, reference_id):
+    """Records that reference_id uses blob_key; returns True if the blob already exists."""
+    with _reference_lock:
+        metadata_storage.write_json(get_reference_prefix(blob_key) + reference_id, {'blob_key': blob_key})
+        return storage.exists(blob_key)
+
+def release_upload(storage, metadata_storage, blob_key, reference_id):
+    """
+    Drops reference_id's reference to a blob, and removes the blob once nothing references it anymore
+    (and its cached metadata once no blob with that content is referenced).
+
+    Returns:
+        bool: True if the blob was removed.
+    """
+    content_hash = os.path.splitext(blob_key[len(BLOB_PREFIX) + 1:])[0]
+    with _reference_lock:
+        metadata_storage.delete(get_reference_prefix(blob_key) + reference_id)
+        if metadata_storage.list_keys(get_reference_prefix(blob_key)):
+            return False
+        storage.delete(blob_key)
+        if not metadata_storage.list_keys(f"{REFERENCE_PREFIX}/{content_hash}"):
+            metadata_storage.delete(get_metadata_key(content_hash))
+    return True
+
+def load_metadata(metadata_storage, content_hash):
+    """Returns the cached metadata dict for a blob (empty if nothing is cached yet)."""
+    return metadata_storage.read_json(get_metadata_key(content_hash), default={})
+
+def update_metadata(metadata_storage, content_hash, **values):
+    """Merges values into a blob's cached metadata (e.g. duration, script)."""
+    with _metadata_lock:
+        metadata = load_metadata(metadata_storage, content_hash)
+        metadata.update(values)
+        metadata_storage.write_json(get_metadata_key(content_hash), metadata)
+    return metadata
+
+def is_upload_of(content_hash, video_key):
+    """Checks that video_key is the blob for content_hash."""
+    if not content_hash or not video_key:
+        return False
+    return os.path.splitext(video_key)[0] == get_blob_key(content_hash)
@@ -0,0 +1,129 @@
+import os
+import time
+import threading
+
+from werkzeug.utils import secure_filename
+
+# Progressive preview of a merge that is still running. The merge's FFmpeg pass writes a second,
+# fragmented MP4 output (moov atom up front, then self-contained fragments at every keyframe), and
+# follow_preview() streams that file to the browser while it grows, so playback starts after the
+# first fragment instead of after the whole merge. The final +faststart MP4 is still the one that
+# gets stored and published. Previews are scratch files local to the node running the merge, which
+# deletes the preview when it ends; that deletion is also how followers know the preview is complete.
+# Browsers normally fetch the preview with Range requests, answered by read_preview_range() with the
+# bytes written so far, so each request is short and the player asks again for the next range.
+# The merge registers its preview with start_preview() until remove_preview(), so requests for a
+# preview that no merge will write (anymore) are answered at once instead of waiting for the file.
+PREVIEW_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+CHUNK_SIZE = 64 * 1024
+MAX_RANGE_BYTES = 4 * 1024 * 1024 # Largest range answered at once; players request the rest as they need it
+RANGE_WAIT_SECONDS = 10 # How long a range request waits for FFmpeg to write past its start
+
+def get_preview_path(preview_folder, preview_id):
+    """Returns the local path of a preview, rejecting ids that are not plain file names."""
+    if not preview_id or secure_filename(preview_id) != preview_id:
+        raise ValueError(f"Invalid preview id: {preview_id!r}")
+    return os.path.join(preview_folder, preview_id)
+
+_active_previews = set()
+_active_previews_lock = threading.Lock()
+
+def start_preview(preview_path):
+    """Marks a preview as being written by a running merge."""
+    with _active_previews_lock:
+        _active_previews.add(preview_path)
+
+def is_preview_active(preview_path):
+    with _active_previews_lock:
+        return preview_path in _active_previews
+
+def remove_preview(preview_path):
+    with _active_previews_lock:
+        _active_previews.discard(preview_path)
+    try:
+        os.remove(preview_path)
+    except FileNotFoundError:
+        pass
+
+def _wait_for_preview(preview_path, poll_interval, timeout):
+    """Waits for the merge to create the preview; False if it does not exist and no merge is writing it."""
+    deadline = time.time() + timeout
+    while not os.path.exists(preview_path):
+        if not is_preview_active(preview_path) or time.time() > deadline:
+            return False
+        time.sleep(poll_interval)
+    return True
+
+def follow_preview(preview_path, poll_interval=0.5, start_timeout=30, idle_timeout=120):
+    """
+    Generator yielding the bytes of a preview as FFmpeg writes them.
+
+    Args:
+        preview_path (str): Path of the fragmented MP4 being written.
+        poll_interval (float): Seconds to sleep when all written bytes have been sent.
+        start_timeout (float): Seconds to wait for FFmpeg to create the file.
+        idle_timeout (float): Gives up if the file stops growing for this long without being removed.
+    """
+    if not _wait_for_preview(preview_path, poll_interval, start_timeout):
+        return
+
+    try:
+        preview_file = open(preview_path, 'rb')
+    except FileNotFoundError:
+        return # The merge ended between the check and the open
+
+    with preview_file:
+        last_growth = time.time()
+        while True:
+            chunk = preview_file.read(CHUNK_SIZE)
+            if chunk:
+                last_growth = time.time()
+                yield chunk
+                continue
+            # At the current end of the file. Once the merge removed it nothing more will be written,
+            # so send whatever arrived since the last read and stop.
+            if os.fstat(preview_file.fileno()).st_nlink == 0:
+                while True:
+                    chunk = preview_file.read(CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+            if time.time() - last_growth > idle_timeout:
+                return
+            time.sleep(poll_interval)
+
+def read_preview_range(preview_path, start, end=None, poll_interval=0.5, wait_timeout=RANGE_WAIT_SECONDS):
+    """
+    Reads bytes start..end (inclusive) of a preview, limited to what FFmpeg has written so far.
+
+    Args:
+        preview_path (str): Path of the fragmented MP4 being written.
+        start (int): First byte to read.
+        end (int, optional): Last byte to read; open-ended if omitted. At most MAX_RANGE_BYTES are read.
+        poll_interval (float): Seconds between checks while waiting.
+        wait_timeout (float): Seconds to wait for the preview to appear or grow past start (only while a
+            merge is writing it).
+
+    Returns:
+        tuple: (data, complete_size) where data may be empty if nothing past start was written in time,
+        and complete_size is the preview's final size once the merge has finished writing it (else None),
+        or None if the preview does not exist.
+    """
+    deadline = time.time() + wait_timeout
+    if not _wait_for_preview(preview_path, poll_interval, wait_timeout):
+        return None
+    try:
+        preview_file = open(preview_path, 'rb')
+    except FileNotFoundError:
+        return None # The merge ended between the check and the open
+
+    with preview_file:
+        while True:
+            stat = os.fstat(preview_file.fileno())
+            finished = stat.st_nlink == 0 # Removed by the merge, so nothing more will be written
+            if stat.st_size > start or finished or time.time() > deadline:
+                break
+            time.sleep(poll_interval)
+        length = MAX_RANGE_BYTES if end is None else min(end - start + 1, MAX_RANGE_BYTES)
+        preview_file.seek(start)
+        return preview_file.read(length), stat.st_size if finished else None
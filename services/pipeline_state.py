@@ -0,0 +1,171 @@
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+from services.media_store import hash_artifact
+
+# Durable per-job checkpoints for the upload -> analyze -> speak -> merge -> publish chain.
+# Each job is a JSON record (jobs/<job_id>.json in the job storage) holding, per completed stage,
+# the stage inputs, the output artifact key and its content hash (plus any small result such as
+# the script). A checkpoint is valid while its inputs are unchanged and its artifact still has that
+# content, so after a restart or failure a job resumes from the first stage without a valid checkpoint.
+# Job records and artifacts both live in storage backends, so any node can resume any job.
+STAGES = ('upload', 'analyze', 'speak', 'merge', 'publish')
+
+_job_lock = threading.Lock() # Serializes read-modify-write of job records within a process
+
+def hash_inputs(inputs):
+    """Returns a stable hash of a stage's inputs (a JSON-serializable dict)."""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def get_job_key(job_id):
+    # Job ids are uuid4 strings; reject anything else so ids cannot address other keys
+    uuid.UUID(job_id)
+    return f"{job_id}.json"
+
+def create_job(job_storage, user_id):
+    """Creates an empty job record owned by user_id and returns its id."""
+    job_id = str(uuid.uuid4())
+    _write_job(job_storage, job_id, {'job_id': job_id, 'user_id': user_id, 'created_at': time.time(), 'checkpoints': {}})
+    return job_id
+
+def is_job_owner(job_storage, job_id, user_id):
+    """Checks that the job exists and was created by user_id (job ids alone are not credentials)."""
+    job = load_job(job_storage, job_id)
+    return bool(job) and job.get('user_id') == user_id
+
+def load_job(job_storage, job_id):
+    """Returns the job record, or None if the job does not exist (or the id is malformed)."""
+    try:
+        return job_storage.read_json(get_job_key(job_id))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def _write_job(job_storage, job_id, job):
+    job_storage.write_json(get_job_key(job_id), job) # Atomic, and fsynced locally: checkpoints must survive a crash
+
+def delete_job(job_storage, job_id):
+    try:
+        job_storage.delete(get_job_key(job_id))
+    except (ValueError, TypeError, AttributeError):
+        pass
+
+def record_checkpoint(job_storage, artifact_storage, job_id, stage, inputs, output_key=None, output_hash=None, result=None):
+    """
+    Records that a stage completed.
+
+    Args:
+        job_storage (services.storage.StorageBackend): Storage holding job records.
+        artifact_storage (services.storage.StorageBackend): Storage holding the stage's output artifact.
+        job_id (str): The job id.
+        stage (str): One of STAGES.
+        inputs (dict): What the stage's output depends on (content hashes, parameters).
+        output_key (str, optional): The artifact the stage produced.
+        output_hash (str, optional): Content hash of the artifact if already known; computed otherwise.
+        result (optional): Small JSON-serializable result to restore on resume (e.g. the script).
+
+    Returns:
+        dict: The recorded checkpoint.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown pipeline stage: {stage}")
+
+    checkpoint = {
+        'inputs': inputs,
+        'inputs_hash': hash_inputs(inputs),
+        'output_key': output_key,
+        'output_hash': None,
+        'result': result,
+        'completed_at': time.time(),
+    }
+    if output_key:
+        stat = artifact_storage.stat(output_key)
+        if stat is None:
+            raise FileNotFoundError(f"Checkpoint artifact {output_key} does not exist.")
+        checkpoint['output_hash'] = output_hash or hash_artifact(artifact_storage, output_key)
+        checkpoint['output_size'] = stat['size']
+        checkpoint['output_version'] = stat['version']
+
+    with _job_lock:
+        job = load_job(job_storage, job_id)
+        if job is None:
+            raise ValueError(f"Pipeline job {job_id} not found.")
+        job['checkpoints'][stage] = checkpoint
+        # Later stages were built from the previous output of this stage, so they are stale now
+        for later_stage in STAGES[STAGES.index(stage) + 1:]:
+            job['checkpoints'].pop(later_stage, None)
+        _write_job(job_storage, job_id, job)
+    return checkpoint
+
+def _artifact_is_intact(artifact_storage, checkpoint):
+    output_key = checkpoint.get('output_key')
+    if not output_key:
+        return True # Stage has no artifact (e.g. analysis result stored inline)
+    stat = artifact_storage.stat(output_key)
+    if stat is None or stat['size'] != checkpoint.get('output_size'):
+        return False
+    # An unchanged version (mtime/ETag) means unchanged content; only rehash when it differs
+    if stat['version'] == checkpoint.get('output_version'):
+        return True
+    return hash_artifact(artifact_storage, output_key) == checkpoint.get('output_hash')
+
+def get_valid_checkpoint(job_storage, artifact_storage, job_id, stage, inputs=None):
+    """
+    Returns the stage's checkpoint if it can be reused, else None.
+    If inputs are given they must match the recorded ones; the artifact must still exist unchanged.
+    """
+    if not job_id:
+        return None
+    job = load_job(job_storage, job_id)
+    if not job:
+        return None
+    checkpoint = job['checkpoints'].get(stage)
+    if not checkpoint:
+        return None
+    if inputs is not None and hash_inputs(inputs) != checkpoint['inputs_hash']:
+        return None
+    if not _artifact_is_intact(artifact_storage, checkpoint):
+        return None
+    return checkpoint
+
+def get_resume_state(job_storage, artifact_storage, job_id):
+    """
+    Walks the stages in order and returns the valid checkpoints up to the first missing or stale one.
+
+    Returns:
+        dict: {'checkpoints': {stage: checkpoint}, 'next_stage': stage name or None when all are done},
+        or None if the job does not exist.
+    """
+    job = load_job(job_storage, job_id)
+    if not job:
+        return None
+    valid_checkpoints = {}
+    for stage in STAGES:
+        checkpoint = job['checkpoints'].get(stage)
+        if not checkpoint or not _artifact_is_intact(artifact_storage, checkpoint):
+            return {'checkpoints': valid_checkpoints, 'next_stage': stage}
+        valid_checkpoints[stage] = checkpoint
+    return {'checkpoints': valid_checkpoints, 'next_stage': None}
+
+def get_variant_keys(checkpoints):
+    """Returns every artifact key recorded by narration variant batches in the given checkpoints."""
+    variant_keys = []
+    for checkpoint in checkpoints.values():
+        result = checkpoint.get('result')
+        if isinstance(result, dict):
+            variant_keys += result.get('variant_keys', [])
+    return variant_keys
+
+def get_output_hash(job_storage, artifact_storage, job_id, key):
+    """Returns the content hash of an artifact, reusing a checkpoint's hash when one recorded this key."""
+    job = load_job(job_storage, job_id) if job_id else None
+    if job:
+        for checkpoint in job['checkpoints'].values():
+            if checkpoint.get('output_key') == key and _artifact_is_intact(artifact_storage, checkpoint):
+                return checkpoint['output_hash']
+    return hash_artifact(artifact_storage, key)
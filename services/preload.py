@@ -0,0 +1,36 @@
+import importlib
+import time
+
+# Third-party SDKs that the services import lazily on first use (see video_analysis._genai
+# and convert_text_to_speech_gemini). Importing them costs seconds, so app startup skips them.
+HEAVY_MODULES = (
+    'google.generativeai',
+    'elevenlabs',
+    'elevenlabs.client',
+)
+
+def warm_up(modules=HEAVY_MODULES):
+    """
+    Imports the heavy service dependencies ahead of time.
+    Meant to run once in the gunicorn master (see gunicorn.conf.py) so forked workers
+    inherit the already-imported modules instead of paying for them on their first request.
+
+    Args:
+        modules (tuple): Module names to import.
+
+    Returns:
+        dict: Import time in seconds per module, or None if the module could not be imported.
+    """
+    timings = {}
+    for module_name in modules:
+        start_time = time.perf_counter()
+        try:
+            importlib.import_module(module_name)
+            timings[module_name] = time.perf_counter() - start_time
+        except Exception as e:
+            # A missing optional SDK should not stop the server from booting; the service
+            # that needs it will raise a clear error when it is actually used.
+            print(f"Warm-up: could not import {module_name}: {e}")
+            timings[module_name] = None
+    print(f"Warm-up: preloaded {', '.join(m for m, t in timings.items() if t is not None) or 'nothing'}")
+    return timings
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import itertools
+import threading
+
+# Shortest-expected-job-first scheduling for the expensive stages (analysis, TTS, merge).
+# Each stage has a fixed number of slots. Waiting jobs are ordered by their estimated cost
+# minus an aging credit for time already spent waiting, so short clips overtake long videos
+# but a long video is never starved. A user may only run a limited number of jobs per stage.
+# A job may ask for several slots (a batch of parallel TTS calls): it is admitted once, like any
+# other job, and then takes as many of the requested slots as are free.
+# Queues and slot counts live in memory, so the app runs as a single threaded gunicorn worker
+# (gunicorn.conf.py) and the slot counts are the limits for the whole server.
+
+# Per stage: (fixed overhead in seconds, initial seconds per unit). Units are seconds of video for
+# analysis and merge, and characters of script for speech. The per-unit rate is then learned from
+# completed jobs (exponential moving average) and persisted so estimates survive restarts.
+DEFAULT_COST_MODELS = {
+    'analyze': (20.0, 0.5),
+    'speak': (2.0, 0.02),
+    'merge': (1.0, 0.05),
+}
+ASSUMED_BYTES_PER_SECOND = 250000 # ~2 Mbit/s, used when a video's duration cannot be probed
+TIMING_SMOOTHING = 0.3 # Weight of the newest observation in the moving average
+
+def estimate_units(stage, duration=None, file_size=None, script_chars=None):
+    """Returns the size of a job in the stage's cost unit (video seconds or script characters)."""
+    if stage == 'speak':
+        return float(script_chars or 0)
+    if duration:
+        return float(duration)
+    if file_size:
+        return file_size / ASSUMED_BYTES_PER_SECOND
+    return 0.0
+
+class StageTimings:
+    """Learned seconds-per-unit rate for every stage, persisted as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._rates = {stage: rate for stage, (_, rate) in DEFAULT_COST_MODELS.items()}
+        try:
+            with open(path, 'r') as timings_file:
+                self._rates.update(json.load(timings_file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def estimate(self, stage, units):
+        overhead = DEFAULT_COST_MODELS[stage][0]
+        with self._lock:
+            return overhead + self._rates[stage] * units
+
+    def record(self, stage, units, elapsed_seconds):
+        """Folds a completed job's duration into the stage's rate."""
+        if units <= 0:
+            return
+        overhead = DEFAULT_COST_MODELS[stage][0]
+        observed_rate = max(elapsed_seconds - overhead, 0.0) / units
+        with self._lock:
+            self._rates[stage] = (1 - TIMING_SMOOTHING) * self._rates[stage] + TIMING_SMOOTHING * observed_rate
+            temp_path = f"{self.path}.{uuid.uuid4()}"
+            try:
+                with open(temp_path, 'w') as timings_file:
+                    json.dump(self._rates, timings_file)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Could not persist stage timings to {self.path}: {e}")
+
+class Ticket:
+    """A job waiting for, or holding, a slot of a stage."""
+
+    def __init__(self, user_id, units, estimate, sequence, max_slots=1):
+        self.user_id = user_id
+        self.units = units
+        self.estimate = estimate
+        self.sequence = sequence # Tie-breaker: first come, first served
+        self.max_slots = max_slots # Slots the job can use in parallel
+        self.slots = 0 # Slots granted when it starts
+        self.submitted_at = time.time()
+        self.started_at = None
+
+class StageScheduler:
+    """
+    Grants the slots of one stage to waiting tickets, shortest expected job first with aging.
+
+    Args:
+        stage (str): Stage name, a key of DEFAULT_COST_MODELS.
+        timings (StageTimings): Shared historical timings used for estimates.
+        max_concurrent (int): Number of jobs of this stage that may run at once.
+        per_user_limit (int): Number of jobs of this stage a single user may run at once.
+        aging_rate (float): Seconds of estimated cost forgiven per second of waiting.
+    """
+
+    def __init__(self, stage, timings, max_concurrent=2, per_user_limit=1, aging_rate=1.0):
+        self.stage = stage
+        self.timings = timings
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_user_limit = max(1, per_user_limit)
+        self.aging_rate = aging_rate
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._running = []
+        self._sequence = itertools.count()
+
+    def submit(self, user_id, units, max_slots=1):
+        """
+        Queues a job of the given size and returns its ticket (possibly already running).
+        A job that can run max_slots parts in parallel counts once against the user's limit and
+        is granted up to max_slots slots when it starts (see Ticket.slots).
+        """
+        max_slots = max(1, min(max_slots, self.max_concurrent))
+        with self._condition:
+            # Parallel parts split the units, so the job takes about as long as one part
+            ticket = Ticket(user_id, units, self.timings.estimate(self.stage, units / max_slots), next(self._sequence), max_slots)
+            self._waiting.append(ticket)
+            self._dispatch()
+            return ticket
+
+    def _priority(self, ticket, now):
+        return (ticket.estimate - self.aging_rate * (now - ticket.submitted_at), ticket.sequence)
+
+    def _dispatch(self):
+        # Caller holds the condition
+        now = time.time()
+        while True:
+            free_slots = self.max_concurrent - sum(running.slots for running in self._running)
+            if free_slots <= 0:
+                break
+            eligible = [
+                ticket for ticket in self._waiting
+                if sum(1 for running in self._running if running.user_id == ticket.user_id) < self.per_user_limit
+            ]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: self._priority(t, now))
+            self._waiting.remove(ticket)
+            ticket.started_at = now
+            ticket.slots = min(ticket.max_slots, free_slots)
+            if ticket.slots < ticket.max_slots:
+                ticket.estimate = self.timings.estimate(self.stage, ticket.units / ticket.slots)
+            self._running.append(ticket)
+        self._condition.notify_all()
+
+    def forecast(self, ticket):
+        """
+        Estimates when a ticket will start and finish by replaying the queue against the slots,
+        holding a queued job back while its user already runs per_user_limit jobs.
+
+        Returns:
+            dict: position (jobs ahead in the queue), estimated_start and estimated_finish (epoch seconds).
+        """
+        with self._condition:
+            now = time.time()
+            if ticket.started_at is not None:
+                return {'position': 0, 'estimated_start': ticket.started_at, 'estimated_finish': ticket.started_at + ticket.estimate}
+
+            slot_free_at = []
+            user_finishes = {} # Finish times of each user's running (and replayed) jobs
+            for running in self._running:
+                finish = max(now, running.started_at + running.estimate)
+                slot_free_at += [finish] * running.slots
+                user_finishes.setdefault(running.user_id, []).append(finish)
+            slot_free_at += [now] * (self.max_concurrent - len(slot_free_at))
+            heapq.heapify(slot_free_at)
+
+            def user_free_at(user_id):
+                # The user is below the limit once all but per_user_limit - 1 of their jobs have finished
+                finishes = sorted(user_finishes.get(user_id, []))
+                return finishes[-self.per_user_limit] if len(finishes) >= self.per_user_limit else now
+
+            queue = sorted(self._waiting, key=lambda t: self._priority(t, now))
+            position = queue.index(ticket) if ticket in queue else 0
+            while queue:
+                # Like _dispatch(), the next free slot goes to the first job in priority order whose user may start one
+                slot_time = heapq.heappop(slot_free_at)
+                starts = [max(slot_time, user_free_at(queued.user_id)) for queued in queue]
+                start = min(starts)
+                queued = queue[starts.index(start)] # Ties go to the higher priority
+                if queued is ticket:
+                    return {'position': position, 'estimated_start': start, 'estimated_finish': start + queued.estimate}
+                queue.remove(queued)
+                heapq.heappush(slot_free_at, start + queued.estimate)
+                user_finishes.setdefault(queued.user_id, []).append(start + queued.estimate)
+            return {'position': 0, 'estimated_start': now, 'estimated_finish': now + ticket.estimate}
+
+    def wait(self, ticket, poll_interval=2.0):
+        """
+        Generator that blocks until the ticket holds a slot, yielding its forecast (see forecast())
+        every poll_interval seconds while it is queued, and once more when it starts.
+        If the caller stops early (e.g. the client disconnected) the ticket is withdrawn.
+        """
+        started = False
+        try:
+            while True:
+                with self._condition:
+                    if ticket.started_at is None:
+                        self._dispatch() # Aging may have changed the order since the last event
+                    started = ticket.started_at is not None
+                yield self.forecast(ticket)
+                if started:
+                    return
+                with self._condition:
+                    if ticket.started_at is None:
+                        self._condition.wait(timeout=poll_interval)
+        finally:
+            if not started:
+                self.cancel(ticket)
+
+    def acquire(self, ticket):
+        """Blocks until the ticket holds a slot (for routes that do not stream progress)."""
+        for _ in self.wait(ticket):
+            pass
+
+    def cancel(self, ticket):
+        """Withdraws a ticket that has not started yet."""
+        with self._condition:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                self._dispatch()
+
+    def release(self, ticket, succeeded=True):
+        """Frees the ticket's slots; successful runs refine the stage's timing estimate."""
+        with self._condition:
+            if ticket in self._running:
+                self._running.remove(ticket)
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._dispatch()
+        if succeeded and ticket.started_at is not None:
+            self.timings.record(self.stage, ticket.units / ticket.slots, time.time() - ticket.started_at)
+
+def create_schedulers(config, timings_path):
+    """Builds one StageScheduler per stage from the app config (SCHEDULER_* settings)."""
+    timings = StageTimings(timings_path)
+    slots = {
+        'analyze': config.get('SCHEDULER_ANALYSIS_SLOTS', 2),
+        'speak': config.get('SCHEDULER_TTS_SLOTS', 4),
+        'merge': config.get('SCHEDULER_MERGE_SLOTS', 2),
+    }
+    return {
+        stage: StageScheduler(stage, timings, max_concurrent=slots[stage],
+                              per_user_limit=config.get('SCHEDULER_PER_USER_LIMIT', 1),
+                              aging_rate=config.get('SCHEDULER_AGING_RATE', 1.0))
+        for stage in DEFAULT_COST_MODELS
+    }
+
+def describe_forecast(forecast, stage_label):
+    """Formats a forecast as a progress message, e.g. for the SSE progress stream."""
+    now = time.time()
+    start_in = max(0, int(forecast['estimated_start'] - now))
+    finish_in = max(0, int(forecast['estimated_finish'] - now))
+    if forecast['position'] == 0 and start_in == 0:
+        return f"{stage_label}: Starting, estimated finish in {finish_in}s"
+    return f"{stage_label}: Queued ({forecast['position']} ahead), estimated start in {start_in}s, finish in {finish_in}s"
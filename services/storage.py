@@ -0,0 +1,366 @@
+import os
+import json
+import uuid
+import tempfile
+from contextlib import contextmanager
+from flask import send_from_directory, redirect, abort
+
+# Artifact storage used by the routes and services instead of raw local paths.
+# Artifacts are addressed by keys (relative, '/'-separated names such as 'abc_video.mp4' or
+# 'blobs/<sha256>'), so session state and checkpoints are valid on every node. The local backend
+# maps keys to files under a folder; the S3 backend maps them to objects under a bucket prefix,
+# which lets any worker on any node pick up any stage of a job.
+
+CHUNK_SIZE = 1024 * 1024 # 1 MiB
+
+class StorageBackend:
+    """Interface shared by the storage backends. Keys never start with '/' and never contain '..'."""
+
+    move_is_rename = False # True when move() renames in place instead of copying the content
+
+    def open_read(self, key):
+        """Returns a binary file-like object streaming the artifact's content."""
+        raise NotImplementedError
+
+    def open_write(self, key):
+        """Context manager yielding a binary file-like object; the artifact appears atomically on exit."""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def stat(self, key):
+        """Returns {'size': bytes, 'version': str} (version changes whenever content may have), or None."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def move(self, source_key, target_key):
+        raise NotImplementedError
+
+    def list_keys(self, prefix):
+        """Returns the keys starting with prefix (a plain string prefix, as in S3)."""
+        raise NotImplementedError
+
+    @contextmanager
+    def local_copy(self, key):
+        """Context manager yielding a local file path with the artifact's content (for tools that need files)."""
+        raise NotImplementedError
+
+    @contextmanager
+    def local_output(self, key):
+        """Context manager yielding a local path to write to; the file is stored under key on successful exit."""
+        raise NotImplementedError
+
+    def input_location(self, key):
+        """Returns a path or URL FFmpeg/ffprobe can read the artifact from directly, without a full download."""
+        raise NotImplementedError
+
+    def serve(self, key):
+        """Returns a Flask response delivering the artifact to a browser."""
+        raise NotImplementedError
+
+    def read_json(self, key, default=None):
+        try:
+            with self.open_read(key) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def write_json(self, key, value):
+        with self.open_write(key) as f:
+            f.write(json.dumps(value).encode('utf-8'))
+
+def get_partial_path(target_path):
+    """Temporary sibling of target_path that is renamed into place once complete (never listed as a key)."""
+    # The extension stays last so tools that pick the format from it (FFmpeg) still can
+    return f"{target_path}.{uuid.uuid4()}.part{os.path.splitext(target_path)[1]}"
+
+def is_partial_name(name):
+    return name.endswith('.part') or os.path.splitext(name)[0].endswith('.part')
+
+def validate_key(key):
+    if not key or key.startswith('/') or '\\' in key or '..' in key.split('/'):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
+
+class LocalStorage(StorageBackend):
+    """Stores artifacts as files under root_folder (e.g. UPLOAD_FOLDER)."""
+
+    move_is_rename = True
+
+    def __init__(self, root_folder):
+        self.root_folder = root_folder
+        os.makedirs(root_folder, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root_folder, *validate_key(key).split('/'))
+
+    def open_read(self, key):
+        return open(self.path(key), 'rb')
+
+    @contextmanager
+    def open_write(self, key):
+        target_path = self.path(key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = f"{target_path}.{uuid.uuid4()}.part"
+        try:
+            with open(temp_path, 'wb') as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, target_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def stat(self, key):
+        try:
+            stat = os.stat(self.path(key))
+        except OSError:
+            return None
+        return {'size': stat.st_size, 'version': str(stat.st_mtime_ns)}
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def move(self, source_key, target_key):
+        target_path = self.path(target_key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(self.path(source_key), target_path)
+
+    def list_keys(self, prefix):
+        directory, _, name_prefix = prefix.rpartition('/')
+        try:
+            names = os.listdir(self.path(directory) if directory else self.root_folder)
+        except FileNotFoundError:
+            return []
+        return [f"{directory}/{name}" if directory else name for name in names
+                if name.startswith(name_prefix) and not is_partial_name(name)]
+
+    @contextmanager
+    def local_copy(self, key):
+        yield self.path(key) # Already local: no copy needed
+
+    @contextmanager
+    def local_output(self, key):
+        # Written next to the target and renamed on success, so a failed merge never leaves a partial, served file
+        target_path = self.path(key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = get_partial_path(target_path)
+        try:
+            yield temp_path
+            if os.path.exists(temp_path):
+                os.replace(temp_path, target_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def input_location(self, key):
+        return self.path(key)
+
+    def serve(self, key):
+        validate_key(key)
+        return send_from_directory(self.root_folder, key)
+
+class S3Storage(StorageBackend):
+    """
+    Stores artifacts as objects in an S3-compatible bucket under a key prefix.
+    Writes use multipart uploads, reads stream the object body, and browsers download via presigned URLs.
+    Works with any S3 API (AWS, MinIO, or a local stand-in such as moto) through endpoint_url.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region_name=None,
+                 access_key_id=None, secret_access_key=None, part_size=8 * 1024 * 1024,
+                 presigned_url_expiry=3600, local_cache_folder=None):
+        # boto3 is only needed for this backend, so it is imported on first use
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.part_size = max(part_size, 5 * 1024 * 1024) # S3's minimum part size
+        self.presigned_url_expiry = presigned_url_expiry
+        self.local_cache_folder = local_cache_folder or tempfile.gettempdir()
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url, region_name=region_name,
+            aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+            config=Config(signature_version='s3v4'),
+        )
+
+    def object_key(self, key):
+        validate_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def open_read(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))['Body']
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    @contextmanager
+    def open_write(self, key):
+        writer = _S3MultipartWriter(self.client, self.bucket, self.object_key(key), self.part_size)
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        writer.complete()
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def stat(self, key):
+        head = self._head(key)
+        if head is None:
+            return None
+        return {'size': head['ContentLength'], 'version': head['ETag']}
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def move(self, source_key, target_key):
+        # S3 has no rename: a server-side copy (the bytes never pass through this node) plus a delete
+        self.client.copy(
+            {'Bucket': self.bucket, 'Key': self.object_key(source_key)},
+            self.bucket, self.object_key(target_key),
+        )
+        self.delete(source_key)
+
+    def list_keys(self, prefix):
+        object_prefix = self.object_key(prefix) if prefix else (f"{self.prefix}/" if self.prefix else '')
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        keys = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=object_prefix):
+            keys += [item['Key'][strip:] for item in page.get('Contents', [])]
+        return keys
+
+    @contextmanager
+    def local_copy(self, key):
+        os.makedirs(self.local_cache_folder, exist_ok=True)
+        local_path = os.path.join(self.local_cache_folder, f"{uuid.uuid4()}_{os.path.basename(key)}")
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), local_path)
+            yield local_path
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+    @contextmanager
+    def local_output(self, key):
+        os.makedirs(self.local_cache_folder, exist_ok=True)
+        local_path = os.path.join(self.local_cache_folder, f"{uuid.uuid4()}_{os.path.basename(key)}")
+        try:
+            yield local_path
+            if os.path.exists(local_path):
+                # upload_file switches to a parallel multipart upload for large files
+                self.client.upload_file(local_path, self.bucket, self.object_key(key))
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+    def presigned_url(self, key, expires_in=None):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.object_key(key)},
+            ExpiresIn=expires_in or self.presigned_url_expiry,
+        )
+
+    def input_location(self, key):
+        # FFmpeg reads HTTP(S) inputs with range requests, so it streams straight from the bucket
+        return self.presigned_url(key)
+
+    def serve(self, key):
+        if not self.exists(key):
+            abort(404)
+        return redirect(self.presigned_url(key)) # Offload the download to the object store
+
+class _S3MultipartWriter:
+    """File-like writer that streams data to S3 as a multipart upload, one part per part_size bytes."""
+
+    def __init__(self, client, bucket, object_key, part_size):
+        self.client = client
+        self.bucket = bucket
+        self.object_key = object_key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.object_key)['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.object_key, UploadId=self.upload_id,
+                                           PartNumber=part_number, Body=body)
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def complete(self):
+        if self.upload_id is None:
+            # Small artifact: a single PUT is cheaper than a one-part multipart upload
+            self.client.put_object(Bucket=self.bucket, Key=self.object_key, Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.object_key, UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.object_key, UploadId=self.upload_id)
+
+def create_storage(config, local_folder, prefix):
+    """
+    Builds the backend selected by STORAGE_BACKEND.
+
+    Args:
+        config (dict): The app config (STORAGE_BACKEND and S3_* settings).
+        local_folder (str): Folder used by the local backend.
+        prefix (str): Key prefix inside the bucket for the S3 backend (e.g. 'uploads' or 'jobs').
+    """
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(local_folder)
+    if backend == 's3':
+        if not config.get('S3_BUCKET'):
+            raise ValueError("STORAGE_BACKEND is 's3' but S3_BUCKET is not configured.")
+        return S3Storage(
+            config['S3_BUCKET'], prefix=prefix,
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region_name=config.get('S3_REGION'),
+            access_key_id=config.get('S3_ACCESS_KEY_ID'),
+            secret_access_key=config.get('S3_SECRET_ACCESS_KEY'),
+            part_size=config.get('S3_MULTIPART_PART_SIZE', 8 * 1024 * 1024),
+            presigned_url_expiry=config.get('S3_PRESIGNED_URL_EXPIRY', 3600),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
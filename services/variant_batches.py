@@ -0,0 +1,57 @@
+import time
+import uuid
+
+# Progress records for /generate_narration_variants. A batch runs in a background thread: the POST
+# starts it and returns its id, and the client polls /narration_variants/<batch_id> until it is
+# complete, so no request stays open for the TTS calls and the FFmpeg pass. Records are kept in the
+# job storage (variant_batches/<batch_id>.json) next to the pipeline jobs. A running batch refreshes
+# its record at least every HEARTBEAT_SECONDS; one that stopped being refreshed was interrupted
+# (e.g. the server restarted) and is reported as failed.
+BATCH_PREFIX = 'variant_batches'
+HEARTBEAT_SECONDS = 5
+STALE_AFTER_SECONDS = 60
+
+def get_batch_key(batch_id):
+    # Batch ids are uuid4 strings; reject anything else so ids cannot address other keys
+    uuid.UUID(batch_id)
+    return f"{BATCH_PREFIX}/{batch_id}.json"
+
+def create_batch(job_storage, batch_id, user_id, variant_count):
+    """Records a new batch as queued and returns the record."""
+    now = time.time()
+    batch = {
+        'batch_id': batch_id,
+        'user_id': user_id,
+        'status': 'queued',
+        'progress': 0,
+        'message': f'Narration variants: {variant_count} variants queued...',
+        'result': None,
+        'created_at': now,
+        'updated_at': now,
+    }
+    job_storage.write_json(get_batch_key(batch_id), batch)
+    return batch
+
+def update_batch(job_storage, batch_id, **values):
+    """Merges values (status, progress, message, result) into a batch record and refreshes its heartbeat."""
+    batch = job_storage.read_json(get_batch_key(batch_id), default={})
+    batch.update(values)
+    batch['updated_at'] = time.time()
+    job_storage.write_json(get_batch_key(batch_id), batch)
+    return batch
+
+def load_batch(job_storage, batch_id):
+    """Returns the batch record, or None if it does not exist (or the id is malformed)."""
+    try:
+        batch = job_storage.read_json(get_batch_key(batch_id))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if batch and batch['status'] in ('queued', 'in_progress') and time.time() - batch['updated_at'] > STALE_AFTER_SECONDS:
+        batch.update(status='error', message='Narration variants failed: the batch was interrupted. Please start it again.')
+    return batch
+
+def delete_batch(job_storage, batch_id):
+    try:
+        job_storage.delete(get_batch_key(batch_id))
+    except (ValueError, TypeError, AttributeError):
+        pass
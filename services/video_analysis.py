@@ -1,16 +1,19 @@
 import os
-import cv2 # Still needed for getting video duration/properties, not frame extraction
 import base64
-import google.generativeai as genai
-from moviepy.editor import VideoFileClip # Still needed for audio properties
 import json
 import time
 from flask import session # Import session if needed for context, but not for direct script storage
 import shutil # For robust directory removal
 
+# google.generativeai (and its grpc/protobuf stack) takes seconds to import, so it is
+# loaded on first use instead of at module import. See services/preload.py for warm-up.
+def _genai():
+    import google.generativeai as genai
+    return genai
+
 # Configure Google Generative AI with the API key
 def configure_gemini(api_key):
-    genai.configure(api_key=api_key)
+    _genai().configure(api_key=api_key)
 
 # This function is no longer needed for frame-by-frame analysis but kept for reference
 def get_base64_encoded_image_for_gemini(image_path, mime_type="image/jpeg"):
@@ -39,7 +42,7 @@ def wait_for_file_active(file_object, timeout=300, interval=5):
         if (time.time() - start_time) > timeout:
             raise Exception(f"File '{file_object.display_name}' did not become ACTIVE within {timeout} seconds.")
 
-        retrieved_file = genai.get_file(file_object.name)
+        retrieved_file = _genai().get_file(file_object.name)
         if retrieved_file.state.name == 'ACTIVE':
             print(f"File '{file_object.display_name}' is now ACTIVE.")
             return retrieved_file
@@ -69,6 +72,7 @@ def analyze_video_with_openai(video_path, temp_output_dir, gemini_api_key):
     if not gemini_api_key:
         raise ValueError("Gemini API Key is required for video analysis but was not provided.")
 
+    genai = _genai()
     configure_gemini(gemini_api_key)
 
     gemini_model = genai.GenerativeModel('gemini-1.5-flash')
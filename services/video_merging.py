@@ -1,8 +1,83 @@
 import subprocess
 import os
 import json # For progress message encoding
+from collections import deque
 
-def merge_video_audio(video_input_path, audio_input_path, output_path):
+from services.merge_preview import PREVIEW_MOVFLAGS
+
+def probe_duration(video_input_path):
+    """
+    Returns the duration of a media file in seconds using ffprobe, or None if it cannot be determined.
+    """
+    try:
+        duration_cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', video_input_path]
+        duration_output = subprocess.check_output(duration_cmd, text=True).strip()
+        return float(duration_output)
+    except Exception as e:
+        print(f"Could not get duration of {video_input_path}: {e}")
+        return None
+
+def _run_ffmpeg_with_progress(command, video_input_path, output_paths, total_duration=None):
+    """
+    Runs an FFmpeg command, yielding JSON progress messages parsed from its stderr.
+    Raises an exception if FFmpeg fails or any expected output file is missing.
+    """
+    # Use subprocess.Popen to run FFmpeg and capture its stderr for progress. stdout is never read,
+    # so it must not be a pipe: once the pipe buffer filled up FFmpeg would block forever.
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    # Get video duration for progress calculation (using ffprobe) unless the caller already knows it
+    if total_duration is None:
+        total_duration = probe_duration(video_input_path)
+    if total_duration is not None:
+        print(f"Video duration for merge progress: {total_duration:.2f} seconds")
+    else:
+        print("Proceeding without duration-based progress.")
+
+    # Only the last lines are kept for error reports, so long merges do not accumulate FFmpeg's log in memory
+    stderr_tail = deque(maxlen=20)
+
+    try:
+        yield from _follow_ffmpeg_progress(process, total_duration, stderr_tail)
+        process.wait() # Wait for the process to complete
+    finally:
+        # Stop FFmpeg if progress parsing failed or the caller went away (e.g. the client disconnected)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stderr.close()
+
+    if process.returncode != 0:
+        error_output = ''.join(stderr_tail)
+        raise Exception(f"FFmpeg process failed with exit code {process.returncode}: {error_output}")
+
+    # Verify output files exist
+    for output_path in output_paths:
+        if not os.path.exists(output_path):
+            raise Exception(f"FFmpeg completed but output file was not found at {output_path}")
+
+def _follow_ffmpeg_progress(process, total_duration, stderr_tail):
+    """Reads FFmpeg's stderr line by line, yielding JSON progress messages."""
+    for line in process.stderr:
+        stderr_tail.append(line)
+        if "time=" in line:
+            try:
+                time_str = line.split("time=")[1].split(" ")[0].strip()
+                h, m, s = map(float, time_str.split(':'))
+                current_time_seconds = h * 3600 + m * 60 + s
+
+                if total_duration and total_duration > 0:
+                    progress_percentage = int((current_time_seconds / total_duration) * 100)
+                    if progress_percentage > 100: progress_percentage = 100 # Cap at 100
+                    yield json.dumps({'status': 'in_progress', 'progress': progress_percentage, 'message': f'Merge: {progress_percentage}% complete'})
+            except Exception as e:
+                # print(f"Error parsing FFmpeg progress line: {line.strip()} - {e}")
+                yield json.dumps({'status': 'in_progress', 'message': 'Merge: Processing...'})
+        elif "Error" in line or "fail" in line.lower():
+            print(f"FFmpeg error: {line.strip()}")
+            raise Exception(f"FFmpeg encountered an error: {line.strip()}")
+
+def merge_video_audio(video_input_path, audio_input_path, output_path, total_duration=None, preview_path=None):
     """
     Merges a video file with an audio file using FFmpeg.
 
@@ -10,6 +85,8 @@ def merge_video_audio(video_input_path, audio_input_path, output_path):
         video_input_path (str): Path to the input video file.
         audio_input_path (str): Path to the input audio file.
         output_path (str): Path where the merged video will be saved.
+        total_duration (float, optional): Known video duration in seconds; probed with ffprobe if omitted.
+        preview_path (str, optional): Also write a fragmented MP4 here in the same pass, playable while it is being written.
 
     Yields:
         str: JSON string indicating progress or completion for SSE.
@@ -25,55 +102,20 @@ def merge_video_audio(video_input_path, audio_input_path, output_path):
         '-c:a', 'aac',  # Re-encode audio to AAC for broader compatibility
         '-map', '0:v:0',
         '-map', '1:a:0',
+        '-movflags', '+faststart', # Move the index to the front so the published file plays while downloading
         '-y', # Overwrite output file if it exists
         output_path
     ]
+    if preview_path:
+        # Second output of the same pass: fragments are complete as soon as they are written
+        command += ['-c:v', 'copy', '-c:a', 'aac', '-map', '0:v:0', '-map', '1:a:0',
+                    '-movflags', PREVIEW_MOVFLAGS, '-f', 'mp4', preview_path]
 
     print(f"Starting video merge with FFmpeg: {video_input_path} + {audio_input_path} -> {output_path}")
     yield json.dumps({'status': 'in_progress', 'progress': 5, 'message': 'Merge: Initializing FFmpeg...'})
 
     try:
-        # Use subprocess.Popen to run FFmpeg and capture its output for progress
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-        # Get video duration for progress calculation (using ffprobe)
-        total_duration = None
-        try:
-            duration_cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', video_input_path]
-            duration_output = subprocess.check_output(duration_cmd, text=True).strip()
-            total_duration = float(duration_output)
-            print(f"Video duration for merge progress: {total_duration:.2f} seconds")
-        except Exception as e:
-            print(f"Could not get video duration for progress: {e}. Proceeding without duration-based progress.")
-
-        # Read FFmpeg's stderr line by line for progress
-        for line in process.stderr:
-            if "time=" in line:
-                try:
-                    time_str = line.split("time=")[1].split(" ")[0].strip()
-                    h, m, s = map(float, time_str.split(':'))
-                    current_time_seconds = h * 3600 + m * 60 + s
-
-                    if total_duration and total_duration > 0:
-                        progress_percentage = int((current_time_seconds / total_duration) * 100)
-                        if progress_percentage > 100: progress_percentage = 100 # Cap at 100
-                        yield json.dumps({'status': 'in_progress', 'progress': progress_percentage, 'message': f'Merge: {progress_percentage}% complete'})
-                except Exception as e:
-                    # print(f"Error parsing FFmpeg progress line: {line.strip()} - {e}")
-                    yield json.dumps({'status': 'in_progress', 'message': 'Merge: Processing...'})
-            elif "Error" in line or "fail" in line.lower():
-                print(f"FFmpeg error: {line.strip()}")
-                raise Exception(f"FFmpeg encountered an error: {line.strip()}")
-
-        process.wait() # Wait for the process to complete
-
-        if process.returncode != 0:
-            error_output = process.stderr.read()
-            raise Exception(f"FFmpeg process failed with exit code {process.returncode}: {error_output}")
-
-        # Verify output file exists
-        if not os.path.exists(output_path):
-            raise Exception(f"FFmpeg completed but output file was not found at {output_path}")
+        yield from _run_ffmpeg_with_progress(command, video_input_path, [output_path], total_duration)
 
         yield json.dumps({'status': 'in_progress', 'progress': 100, 'message': 'Merge: Complete. Finalizing...'})
 
@@ -87,3 +129,74 @@ def merge_video_audio(video_input_path, audio_input_path, output_path):
     # Return the path on successful completion
     return output_path
 
+
+def merge_video_audio_variants(video_input_path, audio_tracks, output_paths, total_duration=None):
+    """
+    Merges a video with several narration tracks in a single FFmpeg pass, so the video is only read once.
+
+    If one output path is given, every track is muxed into it as a separate audio stream
+    (a multi-audio-track MP4). Otherwise there must be one output path per track, and FFmpeg
+    writes all of them at once with the video stream copied into each.
+
+    Args:
+        video_input_path (str): Path to the input video file.
+        audio_tracks (list): Dicts with 'path' and optional 'language' (ISO 639 code) and 'title'.
+        output_paths (list): Output video path(s), see above.
+        total_duration (float, optional): Known video duration in seconds; probed with ffprobe if omitted.
+
+    Yields:
+        str: JSON string indicating progress or completion for SSE.
+    Returns:
+        list: The paths to the saved merged video files on success.
+    """
+    if not audio_tracks:
+        raise ValueError("At least one audio track is required.")
+    multi_track = len(output_paths) == 1
+    if not multi_track and len(output_paths) != len(audio_tracks):
+        raise ValueError("Provide a single output path or one output path per audio track.")
+
+    command = ['ffmpeg', '-i', video_input_path]
+    for track in audio_tracks:
+        command += ['-i', track['path']]
+
+    def track_metadata(stream_index, track):
+        options = []
+        if track.get('language'):
+            options += [f'-metadata:s:a:{stream_index}', f"language={track['language']}"]
+        if track.get('title'):
+            options += [f'-metadata:s:a:{stream_index}', f"title={track['title']}"]
+        return options
+
+    if multi_track:
+        command += ['-map', '0:v:0']
+        for input_index in range(1, len(audio_tracks) + 1):
+            command += ['-map', f'{input_index}:a:0']
+        command += ['-c:v', 'copy', '-c:a', 'aac']
+        for stream_index, track in enumerate(audio_tracks):
+            command += track_metadata(stream_index, track)
+            # Players pick the first track unless told otherwise
+            command += [f'-disposition:a:{stream_index}', 'default' if stream_index == 0 else '0']
+        command += ['-movflags', '+faststart', '-y', output_paths[0]]
+    else:
+        # Output options apply to the output file that follows them
+        for input_index, (track, output_path) in enumerate(zip(audio_tracks, output_paths), start=1):
+            command += ['-map', '0:v:0', '-map', f'{input_index}:a:0', '-c:v', 'copy', '-c:a', 'aac']
+            command += track_metadata(0, track)
+            command += ['-movflags', '+faststart', '-y', output_path]
+
+    print(f"Starting {len(audio_tracks)}-track video merge with FFmpeg: {video_input_path} -> {', '.join(output_paths)}")
+    yield json.dumps({'status': 'in_progress', 'progress': 5, 'message': f'Merge: Initializing FFmpeg for {len(audio_tracks)} narration tracks...'})
+
+    try:
+        yield from _run_ffmpeg_with_progress(command, video_input_path, output_paths, total_duration)
+
+        yield json.dumps({'status': 'in_progress', 'progress': 100, 'message': 'Merge: Complete. Finalizing...'})
+
+    except FileNotFoundError:
+        raise FileNotFoundError("FFmpeg not found. Please ensure FFmpeg is installed and in your system's PATH.")
+    except Exception as e:
+        print(f"Error during video merging: {e}")
+        yield json.dumps({'status': 'error', 'message': f'Video merging failed: {str(e)}'})
+        raise # Re-raise the exception for the caller to handle
+
+    return output_paths
@@ -36,6 +36,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const analysisProgressBarContainer = document.getElementById('analysisProgressBarContainer');
     const analysisProgressBar = document.getElementById('analysisProgressBar');
     const analysisProgressText = document.getElementById('analysisProgressText');
+    const analyzeVideoBtn = document.getElementById('analyzeVideoBtn');
+
+    // Elements for resuming a saved job
+    const resumeJobPrompt = document.getElementById('resumeJobPrompt');
+    const resumeJobBtn = document.getElementById('resumeJobBtn');
+    const startOverBtn = document.getElementById('startOverBtn');
 
     // Section containers to hide/show
     const uploadSection = document.getElementById('uploadSection');
@@ -173,6 +179,48 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Opens the SSE stream for video analysis and shows the script when it completes
+    const startAnalysisStream = (uploadResponseData) => {
+        const es = new EventSource(`/stream_analysis_progress?video_filename=${encodeURIComponent(uploadResponseData.unique_filename)}`);
+
+        es.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.status === 'in_progress') {
+                updateProgressBar(analysisProgressBar, analysisProgressText, data.progress, data.message);
+            } else if (data.status === 'complete') {
+                updateProgressBar(analysisProgressBar, analysisProgressText, 100, data.message);
+                // Ensure data.script is an array before calling map
+                if (scriptTextarea) {
+                    scriptTextarea.value = Array.isArray(data.script) ? data.script.map(item => `${item.time}: ${item.description}`).join('\n') : String(data.script);
+                } else {
+                    console.error("scriptTextarea element not found when trying to set value.");
+                }
+                videoPlayer.src = uploadResponseData.video_url;
+
+                hideSection(uploadSection);
+                showSection(scriptSection);
+                showSection(videoPlaybackSection);
+                if (generateSpeechBtn) generateSpeechBtn.disabled = false;
+                es.close();
+            } else if (data.status === 'error') {
+                updateProgressBar(analysisProgressBar, analysisProgressText, 0, data.message);
+                uploadMessage.className = 'message error';
+                uploadMessage.textContent = data.message || 'Video analysis failed.';
+                resetUI();
+                es.close();
+            }
+        };
+
+        es.onerror = (error) => {
+            console.error('EventSource for analysis failed:', error);
+            updateProgressBar(analysisProgressBar, analysisProgressText, 0, 'Analysis failed due to connection error.');
+            uploadMessage.className = 'message error';
+            uploadMessage.textContent = 'Video analysis failed due to connection error.';
+            resetUI();
+            if (es) es.close();
+        };
+    };
+
     // 1. Video Upload & Analysis (now streamed)
     if (uploadForm) {
         uploadForm.addEventListener('submit', async (e) => {
@@ -199,6 +247,8 @@ document.addEventListener('DOMContentLoaded', () => {
             console.log('File selected:', file.name, 'Type:', file.type);
 
             setProcessingState(document.getElementById('uploadVideoBtn'), uploadMessage, true, 'Starting Upload...');
+            hideSection(resumeJobPrompt);
+            hideSection(analyzeVideoBtn);
             uploadProgressBarContainer.classList.remove('hidden');
             analysisProgressBarContainer.classList.remove('hidden');
 
@@ -208,7 +258,6 @@ document.addEventListener('DOMContentLoaded', () => {
             const formData = new FormData();
             formData.append('video', file);
 
-            let es;
             try {
                 const xhr = new XMLHttpRequest();
                 xhr.open('POST', '/upload_video', true);
@@ -228,44 +277,9 @@ document.addEventListener('DOMContentLoaded', () => {
                             uploadMessage.className = 'message success';
                             uploadMessage.textContent = uploadResponseData.message;
 
-                            es = new EventSource(`/stream_analysis_progress?video_filename=${encodeURIComponent(uploadResponseData.unique_filename)}`);
-
-                            es.onmessage = (event) => {
-                                const data = JSON.parse(event.data);
-                                if (data.status === 'in_progress') {
-                                    updateProgressBar(analysisProgressBar, analysisProgressText, data.progress, data.message);
-                                } else if (data.status === 'complete') {
-                                    updateProgressBar(analysisProgressBar, analysisProgressText, 100, data.message);
-                                    // Ensure data.script is an array before calling map
-                                    if (scriptTextarea) {
-                                        scriptTextarea.value = Array.isArray(data.script) ? data.script.map(item => `${item.time}: ${item.description}`).join('\n') : String(data.script);
-                                    } else {
-                                        console.error("scriptTextarea element not found when trying to set value.");
-                                    }
-                                    videoPlayer.src = uploadResponseData.video_url;
-
-                                    hideSection(uploadSection);
-                                    showSection(scriptSection);
-                                    showSection(videoPlaybackSection);
-                                    if (generateSpeechBtn) generateSpeechBtn.disabled = false;
-                                    es.close();
-                                } else if (data.status === 'error') {
-                                    updateProgressBar(analysisProgressBar, analysisProgressText, 0, data.message);
-                                    uploadMessage.className = 'message error';
-                                    uploadMessage.textContent = data.message || 'Video analysis failed.';
-                                    resetUI();
-                                    es.close();
-                                }
-                            };
-
-                            es.onerror = (error) => {
-                                console.error('EventSource for analysis failed:', error);
-                                updateProgressBar(analysisProgressBar, analysisProgressText, 0, 'Analysis failed due to connection error.');
-                                uploadMessage.className = 'message error';
-                                uploadMessage.textContent = 'Video analysis failed due to connection error.';
-                                resetUI();
-                                if (es) es.close();
-                            };
+                            // Remember the job so it can be resumed after a server restart or failure
+                            if (uploadResponseData.job_id) localStorage.setItem('narratorJobId', uploadResponseData.job_id);
+                            startAnalysisStream(uploadResponseData);
 
                         } else {
                             uploadMessage.className = 'message error';
@@ -385,12 +399,19 @@ document.addEventListener('DOMContentLoaded', () => {
 
             try {
                 // Use EventSource for streaming progress from the backend (now a GET route)
-                const es = new EventSource('/merge_video_audio');
+                // The preview costs the server a second copy of the video, so only ask for it when wanted
+                const mergePreviewCheckbox = document.getElementById('mergePreviewCheckbox');
+                const es = new EventSource(mergePreviewCheckbox && mergePreviewCheckbox.checked ? '/merge_video_audio?preview=1' : '/merge_video_audio');
 
                 es.onmessage = (event) => {
                     const data = JSON.parse(event.data);
                     if (data.status === 'in_progress') {
                         updateProgressBar(mergeProgressBar, mergeProgressText, data.progress, data.message);
+                        if (data.preview_url && mergedVideoPlayer) {
+                            // Play the merge while it is still running to check the narration sync early
+                            mergedVideoPlayer.src = data.preview_url;
+                            mergeSection.classList.add('active');
+                        }
                     } else if (data.status === 'complete') {
                         updateProgressBar(mergeProgressBar, mergeProgressText, 100, data.message);
                         mergeStatusMessage.className = 'message success';
@@ -490,6 +511,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         statusMessage.textContent = data.message;
                         es.close();
                         fetch('/cleanup_files', { method: 'POST' });
+                        localStorage.removeItem('narratorJobId');
                     } else if (data.status === 'error') {
                         updateProgressBar(youtubeProgressBar, youtubeProgressText, 0, data.message);
                         statusMessage.className = 'message error';
@@ -525,4 +547,105 @@ document.addEventListener('DOMContentLoaded', () => {
     } else {
         console.error("YouTube Upload button not found!");
     }
+
+
+    // 6. Resume a checkpointed job (e.g. after a server restart mid-pipeline)
+    const resumeJob = async (jobId) => {
+        try {
+            const response = await fetch('/resume_job', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ job_id: jobId })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                console.warn('Could not resume job:', data.error);
+                localStorage.removeItem('narratorJobId');
+                return;
+            }
+
+            uploadMessage.className = 'message success';
+            uploadMessage.textContent = `Resumed your previous job (${data.completed_stages.join(', ')} done).`;
+
+            if (!data.script) {
+                // Only the upload survived: analysis is a paid call, so let the user start it again
+                videoPlayer.src = data.video_url;
+                showSection(videoPlaybackSection);
+                uploadMessage.textContent = 'Your video is still uploaded, but its analysis did not finish. Click "Analyze Video" to run it again.';
+                if (analyzeVideoBtn) {
+                    analyzeVideoBtn.onclick = () => {
+                        hideSection(analyzeVideoBtn);
+                        analysisProgressBarContainer.classList.remove('hidden');
+                        updateProgressBar(analysisProgressBar, analysisProgressText, 0, 'Analysis: Resuming...');
+                        startAnalysisStream(data);
+                    };
+                    showSection(analyzeVideoBtn);
+                }
+                return;
+            }
+
+            if (scriptTextarea) scriptTextarea.value = data.script.map(item => `${item.time}: ${item.description}`).join('\n');
+            videoPlayer.src = data.video_url;
+            hideSection(uploadSection);
+            showSection(scriptSection);
+            showSection(videoPlaybackSection);
+            if (generateSpeechBtn) generateSpeechBtn.disabled = false;
+
+            if (data.audio_url) {
+                if (audioPlayer) audioPlayer.src = data.audio_url;
+                showSection(scriptAudioSection);
+                if (createNarratedVideoBtn) {
+                    createNarratedVideoBtn.disabled = false;
+                    createNarratedVideoBtn.classList.remove('disabled');
+                }
+            }
+
+            if (data.merged_video_url) {
+                showSection(mergeSection);
+                if (mergedVideoPlayer) mergedVideoPlayer.src = data.merged_video_url;
+                if (playMergedVideoBtn) playMergedVideoBtn.disabled = false;
+                if (downloadMergedVideoBtn) {
+                    downloadMergedVideoBtn.href = data.merged_video_url;
+                    downloadMergedVideoBtn.classList.remove('disabled');
+                }
+                mergeSection.classList.add('active');
+                if (youtubeUploadBtn) youtubeUploadBtn.disabled = false;
+            }
+        } catch (error) {
+            console.error('Network error while resuming job:', error);
+        }
+    };
+
+    // Discards a saved job and everything it stored
+    const startOver = async (jobId) => {
+        localStorage.removeItem('narratorJobId');
+        resetUI();
+        try {
+            await fetch('/cleanup_files', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ job_id: jobId })
+            });
+        } catch (error) {
+            console.error('Network error while discarding job:', error);
+        }
+    };
+
+    // Offer to resume a saved job instead of resuming it automatically on every page load
+    const savedJobId = localStorage.getItem('narratorJobId');
+    if (savedJobId && resumeJobPrompt) {
+        showSection(resumeJobPrompt);
+        resumeJobBtn.addEventListener('click', () => {
+            hideSection(resumeJobPrompt);
+            resumeJob(savedJobId);
+        });
+        startOverBtn.addEventListener('click', () => {
+            hideSection(resumeJobPrompt);
+            startOver(savedJobId);
+        });
+    }
 });